@@ -1,30 +1,181 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
 import os
 import random
 import traceback
 
 import disnake
 from disnake.ext import commands, tasks
+from PIL import Image, ImageOps
+
+logger = logging.getLogger("cogs.server_icon")
 
 GUILD = 384811165949231104
 IMG_DIR = "./data/server-icons"
+MANIFEST_FILE = f"{IMG_DIR}/manifest.json"
 PLAN_Z = 507429352720433152
 
+ICON_SIZE = 1024  # px, larger images are scaled down to fit
+ICON_MAX_BYTES = 8 * 1024 * 1024  # discord's limit is 10MiB, stay below it
+UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+
+
+def prepare_icon(data):
+    """Returns (bytes, extension, width, height) of an image fit for a server icon.
+    Animated GIFs under the size limit are kept as they are, anything else is
+    scaled down to ICON_SIZE and re-encoded as PNG. Blocking, run it in a thread."""
+    with Image.open(io.BytesIO(data)) as image:
+        if (
+            image.format == "GIF"
+            and getattr(image, "is_animated", False)
+            and len(data) <= ICON_MAX_BYTES
+        ):
+            return data, "gif", image.width, image.height
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.thumbnail((ICON_SIZE, ICON_SIZE), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "PNG", optimize=True)
+        return out.getvalue(), "png", image.width, image.height
+
+
+def describe_icon(path):
+    """Manifest entry for an icon file. Blocking."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+    return {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "width": width,
+        "height": height,
+        "size": len(data),
+    }
+
+
+class IconStore:
+    """The icon folder plus a manifest of its files (hash, dimensions, size) and a
+    shuffled rotation order, both persisted in MANIFEST_FILE so the folder is only
+    scanned when the manifest is missing or out of date."""
+
+    def __init__(self, directory=IMG_DIR, manifest_file=MANIFEST_FILE):
+        self.directory = directory
+        self.manifest_file = manifest_file
+        self.icons = {}  # file name -> manifest entry
+        self.hashes = {}  # sha256 -> file name
+        self.order = []  # file names, in rotation order
+        self.position = 0
 
-def find_file(i):
-    images = os.listdir(IMG_DIR)
-    for img_name in images:
-        if img_name.startswith(str(i)):
-            return f"{IMG_DIR}/{img_name}"
-    return
+    def path(self, name):
+        return os.path.join(self.directory, name)
 
+    def load(self):
+        """Loads the manifest, indexing (and if needed shrinking) files it doesn't
+        know about and dropping the ones that are gone. Blocking."""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.manifest_file) as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            manifest = {}
+        self.icons = manifest.get("icons", {})
+        self.order = manifest.get("order", [])
+        self.position = manifest.get("position", 0)
+
+        manifest_name = os.path.basename(self.manifest_file)
+        names = {
+            entry.name
+            for entry in os.scandir(self.directory)
+            if entry.is_file()
+            and entry.name != manifest_name
+            and not entry.name.endswith(".tmp")
+        }
+        changed = False
+        for name in set(self.icons) - names:
+            del self.icons[name]
+            changed = True
+        for name in names - set(self.icons):
+            try:
+                new_name, icon = self._index(name)
+            except (OSError, Image.UnidentifiedImageError) as e:
+                logger.warning(f"Skipping icon {name}: {e}")
+                continue
+            self.icons[new_name] = icon
+            changed = True
+
+        self.hashes = {icon["sha256"]: name for name, icon in self.icons.items()}
+        if changed or sorted(self.order) != sorted(self.icons):
+            self.shuffle()
+
+    def _index(self, name):
+        """Returns (file name, manifest entry) for a file new to the manifest."""
+        icon = describe_icon(self.path(name))
+        if (
+            icon["size"] <= ICON_MAX_BYTES
+            and max(icon["width"], icon["height"]) <= ICON_SIZE
+        ):
+            return name, icon
+        # icons from before the store existed may be too big, shrink them once
+        with open(self.path(name), "rb") as fp:
+            data, ext, _, _ = prepare_icon(fp.read())
+        new_name = f"{os.path.splitext(name)[0]}.{ext}"
+        with open(self.path(new_name), "wb") as fp:
+            fp.write(data)
+        if new_name != name:
+            os.remove(self.path(name))
+        logger.info(f"Shrunk icon {name} to {len(data)} bytes as {new_name}.")
+        return new_name, describe_icon(self.path(new_name))
 
-def shuffle_server_icons():
-    names = list(range(len(os.listdir(IMG_DIR))))
-    random.shuffle(names)
+    def save(self):
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(
+                {"icons": self.icons, "order": self.order, "position": self.position},
+                fp,
+            )
+        os.replace(tmp, self.manifest_file)
 
-    for img_name in os.listdir(IMG_DIR):
-        ext = img_name.split(".")[-1]
-        os.rename(f"{IMG_DIR}/{img_name}", f"{IMG_DIR}/{names.pop()}.{ext}")
+    def shuffle(self):
+        self.order = list(self.icons)
+        random.shuffle(self.order)
+        self.position = 0
+        self.save()
+
+    def next(self):
+        """Returns the file name of the next icon, reshuffling after a full cycle."""
+        if not self.order:
+            return None
+        if self.position >= len(self.order):
+            self.shuffle()
+        name = self.order[self.position]
+        self.position += 1
+        self.save()
+        return name
+
+    def add(self, data, ext, width, height):
+        """Stores an image prepared by prepare_icon, returns (file name, whether it
+        was new)."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 in self.hashes:
+            return self.hashes[sha256], False
+        name = f"{sha256[:16]}.{ext}"
+        with open(self.path(name), "wb") as fp:
+            fp.write(data)
+        self.icons[name] = {
+            "sha256": sha256,
+            "width": width,
+            "height": height,
+            "size": len(data),
+        }
+        self.hashes[sha256] = name
+        # somewhere in what's left of this cycle, so it shows up before the reshuffle
+        self.order.insert(random.randint(self.position, len(self.order)), name)
+        self.save()
+        return name, True
 
 
 class ServerIcon(commands.Cog):
@@ -32,6 +183,8 @@ class ServerIcon(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.store = IconStore()
+        self.store.load()
         # self.check_if_new_week.start()
 
     async def cog_command_error(self, ctx, error):
@@ -41,8 +194,10 @@ class ServerIcon(commands.Cog):
     async def rotate_server_icon(self):
         try:
             guild = self.bot.get_guild(GUILD)
-            img = random.choice(os.listdir(IMG_DIR))
-            img_path = f"{IMG_DIR}/{img}"
+            name = self.store.next()
+            if name is None:
+                return await self.log("No server icons to rotate to.")
+            img_path = self.store.path(name)
             with open(img_path, "rb") as fp:
                 icon = fp.read()
             await guild.edit(icon=icon)
@@ -62,22 +217,46 @@ class ServerIcon(commands.Cog):
     @commands.group(invoke_without_command=True)
     async def icons(self, ctx):
         """Base command for controlling server icon."""
-        images = os.listdir(IMG_DIR)
-        count = len(images)
-        await ctx.send(f"Found `{count}` total images: ```py\n{images}\n```")
+        store = self.store
+        count = len(store.icons)
+        size = sum(icon["size"] for icon in store.icons.values())
+        upcoming = store.order[store.position : store.position + 10]
+        await ctx.send(
+            f"Found `{count}` total images ({size / 1024 / 1024:.1f}MiB), "
+            f"`{len(store.order) - store.position}` left this cycle. "
+            f"Up next: ```py\n{upcoming}\n```"
+        )
 
     @icons.command()
     async def rotate(self, ctx):
         """Rotate to the next server icon."""
         await self.rotate_server_icon()
 
+    @icons.command()
+    async def shuffle(self, ctx):
+        """Start a new, reshuffled rotation cycle."""
+        self.store.shuffle()
+        await ctx.send(f"Shuffled `{len(self.store.order)}` images.")
+
     @icons.command()
     async def upload(self, ctx):
         """Add a new image to the icon folder."""
         attachment = ctx.message.attachments[0]
-        filename = f"{IMG_DIR}/{attachment.filename}"
-        await attachment.save(filename)
-        await ctx.send(f"Saved as `{filename}`.")
+        if attachment.size > UPLOAD_MAX_BYTES:
+            return await ctx.send(
+                f"That image is too large, the limit is {UPLOAD_MAX_BYTES} bytes."
+            )
+        data = await attachment.read()
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(None, prepare_icon, data)
+        name, new = self.store.add(*prepared)
+        if not new:
+            return await ctx.send(f"That image is already saved as `{name}`.")
+        icon = self.store.icons[name]
+        await ctx.send(
+            f"Saved as `{self.store.path(name)}` "
+            f"({icon['width']}x{icon['height']}, {icon['size']} bytes)."
+        )
 
 
 def setup(bot):
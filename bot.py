@@ -1,50 +1,213 @@
+import asyncio
 import logging
 import os
+import time
 
-import aiohttp
 import disnake
+from aiohttp import web
 from disnake.ext import commands
 
 from utils import settings
-from utils.checks import is_mod
+from utils.checks import ModeratorCache, is_mod
+from utils.http import HTTPSession
+from utils.metrics import Metrics
+from utils.parser import ARGS
+from utils.resolver import Resolver
+from utils.startup import StartupTimer
+from utils.utility import MessageIndex
 
 logger = logging.getLogger("bot")
 help_command = commands.MinimalHelpCommand()
 
 
 class Squire(commands.Bot):
-    def __init__(self, started_at, **kwargs):
+    def __init__(self, started_at, startup=None, **kwargs):
+        self.cache_profile = ARGS.cache_profile or settings.CACHE_PROFILE
+        try:
+            profile = settings.PROFILES[self.cache_profile]
+        except KeyError:
+            raise ValueError(
+                f"Unknown cache profile {self.cache_profile!r}, "
+                f"pick one of {', '.join(settings.PROFILES)}."
+            ) from None
         super().__init__(
             command_prefix=settings.prefix,
             description="sQUIRE, Defender of Bikini Bottom",
             help_command=help_command,
-            intents=settings.intents,
+            **profile,
             **kwargs,
         )
+        # the moderator cache needs every member of the mod role to be cached
+        self._full_member_cache = (
+            profile["intents"].members and profile["chunk_guilds_at_startup"]
+        )
         self.version = settings.version
         self.started_at = started_at
+        self.startup = startup or StartupTimer()
         self.session = None
+        self.message_index = MessageIndex()
+        self.metrics = Metrics()
+        self.moderators = ModeratorCache()
+        self.resolver = Resolver(self)
+        self._metrics_task = None
+        self._metrics_runner = None
         self.add_check(lambda ctx: is_mod(ctx.author))
         self._exit_code = 0
+        self._deferred_cogs_loaded = False
+        self._connected_at = None
+
+    async def start(self, *args, **kwargs):
+        # created before connecting so it's there for the first command
+        self.session = HTTPSession()
+        self._metrics_task = asyncio.create_task(self.run_metrics())
+        if settings.METRICS_PORT:
+            await self.serve_metrics(settings.METRICS_PORT)
+        await super().start(*args, **kwargs)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        self.metrics.inc("events_dispatched")
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # every listener (bot and cog) is run through here, time each one
+        start = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            self.metrics.observe_event(
+                event_name, coro.__qualname__, time.perf_counter() - start
+            )
+
+    async def invoke(self, ctx):
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command:
+                self.metrics.observe_command(
+                    ctx.command.qualified_name, time.perf_counter() - start
+                )
+
+    async def run_metrics(self):
+        """Measures event loop lag and periodically dumps metrics to a file."""
+        loop = asyncio.get_running_loop()
+        interval = settings.LOOP_LAG_INTERVAL
+        last_dump = loop.time()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(interval)
+            now = loop.time()
+            self.metrics.loop_lag.observe(max(0.0, now - before - interval))
+            if (
+                settings.METRICS_FILE
+                and now - last_dump >= settings.METRICS_DUMP_INTERVAL
+            ):
+                last_dump = now
+                try:
+                    await loop.run_in_executor(None, self.dump_metrics)
+                except OSError as e:
+                    logger.warning(f"Could not write metrics file: {e}")
+
+    def dump_metrics(self):
+        tmp = settings.METRICS_FILE + ".tmp"
+        with open(tmp, "w") as fp:
+            fp.write(self.metrics.render())
+        os.replace(tmp, settings.METRICS_FILE)
+
+    async def serve_metrics(self, port):
+        async def handler(request):
+            return web.Response(text=self.metrics.render())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+        self._metrics_runner = web.AppRunner(app)
+        await self._metrics_runner.setup()
+        await web.TCPSite(self._metrics_runner, "127.0.0.1", port).start()
+        logger.info(f"Serving metrics on port {port}.")
 
     async def on_ready(self):
-        logger.info(f"Logged in as {self.user}. Bot is ready.")
-        if not self.session:
-            self.session = aiohttp.ClientSession()
+        logger.info(
+            f"Logged in as {self.user}. Bot is ready "
+            f"(cache profile {self.cache_profile})."
+        )
+        if self._full_member_cache:
+            self.moderators.build(self.guilds)
+        if not self._deferred_cogs_loaded:
+            self._deferred_cogs_loaded = True
+            self.startup.timings.append(("ready", "on_ready", self.startup.elapsed()))
+            if self._connected_at is not None:
+                self.startup.timings.append(
+                    (
+                        "ready",
+                        "connect to on_ready",
+                        time.perf_counter() - self._connected_at,
+                    )
+                )
+            self.load_cogs(deferred=True)
+            logger.info(self.startup.report())
+            if ARGS.profile_startup:
+                self.write_startup_report()
+
+    async def on_connect(self):
+        if self._connected_at is None:
+            self._connected_at = time.perf_counter()
+            self.startup.timings.append(("ready", "connect", self.startup.elapsed()))
+
+    def write_startup_report(self):
+        path = f"logs/startup-{self.started_at:%m-%d_%Hh%Mm}.txt"
+        try:
+            self.startup.write_report(path)
+            logger.info(f"Wrote startup report to {path}.")
+        except OSError as e:
+            logger.warning(f"Could not write startup report: {e}")
+        return path
 
     async def on_message(self, message):
+        self.message_index.add(message)
         # ignore bots
         if message.author.bot:
             return
+        # every command is mod-only, so skip building a Context for anything that
+        # can't be one: no prefix, or an author who definitely isn't a mod
+        if not message.content.startswith(settings.prefix):
+            self.metrics.inc("messages_skipped")
+            return
+        if not self.moderators.might_be_mod(message.author.id):
+            self.metrics.inc("messages_skipped")
+            return
         # process_commands
-        else:
-            await self.process_commands(message)
+        await self.process_commands(message)
+
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self.moderators.update(after)
+
+    async def on_member_remove(self, member):
+        self.moderators.remove(member)
+
+    async def on_raw_message_delete(self, payload):
+        self.message_index.remove(payload.channel_id, payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.message_index.remove(payload.channel_id, message_id)
+
+    async def on_guild_channel_delete(self, channel):
+        self.message_index.remove_channel(channel.id)
+
+    async def on_raw_thread_delete(self, payload):
+        self.message_index.remove_channel(payload.thread_id)
 
-    def load_cogs(self):
-        logger.info("Loading cogs.")
+    def load_cogs(self, deferred=False):
+        """Loads settings.COGS. Cogs in settings.DEFERRED_COGS are skipped unless
+        deferred is set, they're loaded once the bot is ready instead."""
+        logger.info("Loading deferred cogs." if deferred else "Loading cogs.")
         for cog in settings.COGS:
+            if (cog in settings.DEFERRED_COGS) != deferred:
+                continue
             try:
-                self.load_extension(cog)
+                with self.startup.measure("cog", cog):
+                    self.load_extension(cog)
                 logger.info(f" - {cog}")
             except commands.ExtensionFailed as e:
                 logger.exception(
@@ -53,6 +216,10 @@ class Squire(commands.Bot):
         logger.info("Cogs loaded.")
 
     async def close(self):
-        await self.session.close()
-        del self.session
+        if self._metrics_task:
+            self._metrics_task.cancel()
+        if self._metrics_runner:
+            await self._metrics_runner.cleanup()
+        if self.session:
+            await self.session.close()
         await super().close()
@@ -3,8 +3,11 @@ import contextlib
 import inspect
 import io
 import logging
+import os
+import signal
 import subprocess
 import textwrap
+import time
 import traceback
 from contextlib import redirect_stdout
 
@@ -12,19 +15,41 @@ import disnake
 from disnake.ext import commands
 
 from utils import checks
+from utils.profiler import (
+    MemoryTracker,
+    SamplingProfiler,
+    dump_stats,
+    profile_stats,
+    profile_window,
+)
 
 logger = logging.getLogger("cogs.admin")
 
+OUTPUT_MAX_PAGES = 5  # longer output is sent as a file instead
+PROCESS_TIMEOUT = 5 * 60  # seconds
+PROCESS_MAX_OUTPUT = 8 * 1024 * 1024  # characters kept from a process
+LIVE_EDIT_INTERVAL = 2  # seconds between edits of the live output message
+LIVE_TAIL_SIZE = 1800  # characters of output shown in the live message
+CPROFILE_MAX_SECONDS = 120
+
 
 class Admin(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self._last_result = None
         self.sessions = set()
+        self.processes = {}  # channel id -> task running a shell command
+        self.sampler = None
+        self.memory = MemoryTracker()
+        self._profiling = False
 
     def cog_check(self, ctx):
         return checks.is_admin(ctx.author)
 
+    def cog_unload(self):
+        if self.sampler is not None and self.sampler.running:
+            self.sampler.stop()
+
     @staticmethod
     def cleanup_code(content):
         """Automatically removes code blocks from the code."""
@@ -35,25 +60,174 @@ class Admin(commands.Cog):
         # remove `foo`
         return content.strip("` \n")
 
-    async def run_process(self, command):
+    @staticmethod
+    def kill_process(process):
+        """Kills a process started by run_process along with its children."""
+        if process.returncode is not None:
+            return
+        if hasattr(os, "killpg"):
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+
+    async def run_process(self, command, output, timeout=None):
+        """Runs a shell command, appending stdout and stderr to the output list as
+        they arrive. Returns the exit code. Kills the process if it takes longer than
+        timeout (raising asyncio.TimeoutError) or the task is cancelled."""
+        timeout = timeout or PROCESS_TIMEOUT
+        # own process group, so killing it also kills whatever the shell started
+        kwargs = {"start_new_session": True} if hasattr(os, "killpg") else {}
         try:
             process = await asyncio.create_subprocess_shell(
-                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs
             )
-            result = await process.communicate()
         except NotImplementedError:
+            # no subprocess support in this event loop, can't stream
             process = subprocess.Popen(
-                command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                command,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                **kwargs,
             )
-            result = await self.bot.loop.run_in_executor(None, process.communicate)
+            try:
+                result = await asyncio.wait_for(
+                    self.bot.loop.run_in_executor(None, process.communicate), timeout
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self.kill_process(process)
+                raise
+            output.append(result[0].decode(errors="replace"))
+            return process.returncode
+
+        async def read():
+            size = 0
+            while chunk := await process.stdout.read(4096):
+                size += len(chunk)
+                if size <= PROCESS_MAX_OUTPUT:
+                    output.append(chunk.decode(errors="replace"))
+            if size > PROCESS_MAX_OUTPUT:
+                output.append(f"\n[{size - PROCESS_MAX_OUTPUT} characters dropped]")
+            return await process.wait()
 
-        return [output.decode() for output in result]
+        try:
+            return await asyncio.wait_for(read(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.kill_process(process)
+            raise
+
+    async def send_output(self, ctx, text, filename="output.txt"):
+        """Sends text in code blocks, over several messages if needed, or as a file
+        if it would take more than OUTPUT_MAX_PAGES messages."""
+        paginator = commands.Paginator(prefix="```py", max_size=2000)
+        for line in text.replace("```", "``\u200b`").splitlines():
+            # the paginator only takes lines that fit in a page
+            for i in range(0, len(line), 1980):
+                paginator.add_line(line[i : i + 1980])
+        if len(paginator.pages) > OUTPUT_MAX_PAGES:
+            return await ctx.send(
+                f"Output is {len(text)} characters long.",
+                file=disnake.File(io.StringIO(text), filename=filename),
+            )
+        for page in paginator.pages:
+            await ctx.send(page)
 
     def get_syntax_error(self, e):
         if e.text is None:
             return f"```py\n{e.__class__.__name__}: {e}\n```"
         return f'```py\n{e.text}{"^":>{e.offset}}\n{e.__class__.__name__}: {e}```'
 
+    @commands.group(invoke_without_command=True)
+    async def metrics(self, ctx):
+        """Shows listener, command and event loop latency."""
+        summary = self.bot.metrics.summary()
+        if len(summary) > 1990:
+            return await ctx.send(
+                file=disnake.File(io.StringIO(summary), filename="metrics.txt")
+            )
+        await ctx.send(f"```\n{summary}\n```")
+
+    @metrics.command(name="dump")
+    async def metrics_dump(self, ctx):
+        """Uploads all metrics in Prometheus text format."""
+        await ctx.send(
+            file=disnake.File(io.StringIO(self.bot.metrics.render()), "metrics.prom")
+        )
+
+    @commands.group(invoke_without_command=True)
+    async def profiler(self, ctx):
+        """Profiles the running bot."""
+        await ctx.send_help(ctx.command)
+
+    @profiler.command(name="start")
+    async def profiler_start(self, ctx, interval_ms: float = 5):
+        """Starts sampling the event loop's stack every interval_ms."""
+        if self.sampler is not None and self.sampler.running:
+            return await ctx.send("The sampling profiler is already running.")
+        self.sampler = SamplingProfiler(interval=interval_ms / 1000)
+        self.sampler.start()
+        await ctx.send(f"Sampling every {interval_ms}ms. Stop with `profiler stop`.")
+
+    @profiler.command(name="stop")
+    async def profiler_stop(self, ctx):
+        """Stops the sampling profiler and uploads the collapsed stacks."""
+        if self.sampler is None or not self.sampler.running:
+            return await ctx.send("The sampling profiler isn't running.")
+        self.sampler.stop()
+        await self.send_output(ctx, self.sampler.summary())
+        await ctx.send(
+            "Collapsed stacks, for flamegraph.pl or speedscope:",
+            file=disnake.File(
+                io.StringIO(self.sampler.collapsed()), filename="profile.folded"
+            ),
+        )
+
+    @profiler.command(name="cprofile")
+    async def profiler_cprofile(
+        self, ctx, seconds: float = 10, sort: str = "cumulative"
+    ):
+        """Runs cProfile on the event loop for some seconds, uploads a pstats dump."""
+        if self._profiling:
+            return await ctx.send("cProfile is already running.")
+        seconds = min(seconds, CPROFILE_MAX_SECONDS)
+        await ctx.send(f"Profiling for {seconds}s...")
+        self._profiling = True
+        try:
+            profile = await profile_window(seconds)
+        finally:
+            self._profiling = False
+        try:
+            stats = profile_stats(profile, sort)
+        except KeyError:
+            return await ctx.send(f"Can't sort by `{sort}`.")
+        await self.send_output(ctx, stats, filename="profile.txt")
+        await ctx.send(
+            file=disnake.File(io.BytesIO(dump_stats(profile)), "profile.pstats")
+        )
+
+    @profiler.group(name="memory", invoke_without_command=True)
+    async def profiler_memory(self, ctx, limit: int = 15):
+        """Shows memory growth since `profiler memory start`."""
+        if self.memory.baseline is None:
+            return await ctx.send("Start tracing with `profiler memory start` first.")
+        diff = await self.bot.loop.run_in_executor(
+            None, self.memory.diff, "lineno", limit
+        )
+        await self.send_output(ctx, diff, filename="memory.txt")
+
+    @profiler_memory.command(name="start")
+    async def profiler_memory_start(self, ctx):
+        """Starts tracemalloc and takes the baseline snapshot."""
+        await self.bot.loop.run_in_executor(None, self.memory.start)
+        await ctx.send("Tracing allocations. Note that this slows the bot down.")
+
+    @profiler_memory.command(name="stop")
+    async def profiler_memory_stop(self, ctx):
+        """Stops tracemalloc."""
+        self.memory.stop()
+        await ctx.send("Stopped tracing allocations.")
+
     @commands.command(name="eval", aliases=["e"])
     async def _eval(self, ctx, *, body: str):
         """Runs arbitrary python code"""
@@ -86,7 +260,7 @@ class Admin(commands.Cog):
                 ret = await func()
         except Exception as e:
             value = stdout.getvalue()
-            await ctx.send(f"```py\n{value}{traceback.format_exc()}\n```")
+            await self.send_output(ctx, f"{value}{traceback.format_exc()}")
         else:
             value = stdout.getvalue()
             # try:
@@ -96,10 +270,10 @@ class Admin(commands.Cog):
 
             if ret is None:
                 if value:
-                    await ctx.send(f"```py\n{value}\n```")
+                    await self.send_output(ctx, value)
             else:
                 self._last_result = ret
-                await ctx.send(f"```py\n{value}{ret}\n```")
+                await self.send_output(ctx, f"{value}{ret}")
 
     @commands.command()
     async def repl(self, ctx):
@@ -176,26 +350,80 @@ class Admin(commands.Cog):
                         result = await result
             except Exception as e:
                 value = stdout.getvalue()
-                fmt = f"```py\n{value}{traceback.format_exc()}\n```"
+                fmt = f"{value}{traceback.format_exc()}"
             else:
                 value = stdout.getvalue()
                 if result is not None:
-                    fmt = f"```py\n{value}{result}\n```"
+                    fmt = f"{value}{result}"
                     variables["_"] = result
                 elif value:
-                    fmt = f"```py\n{value}\n```"
+                    fmt = value
 
             try:
                 if fmt is not None:
-                    if len(fmt) > 2000:
-                        await ctx.send("Content too big to be printed.")
-                    else:
-                        await ctx.send(fmt)
+                    await self.send_output(ctx, fmt)
             except disnake.Forbidden:
                 pass
             except disnake.HTTPException as e:
                 await ctx.send(f"Unexpected error: `{e}`")
 
+    @commands.command(name="sh", aliases=["shell"])
+    async def shell(self, ctx, *, command):
+        """Runs a shell command, showing its output as it arrives."""
+        if ctx.channel.id in self.processes:
+            return await ctx.send(
+                "Already running a command in this channel. Stop it with `shcancel`."
+            )
+        command = self.cleanup_code(command)
+        output = []
+        start = time.perf_counter()
+        message = await ctx.send("Running...")
+
+        def render(status):
+            tail = "".join(output)[-LIVE_TAIL_SIZE:].replace("```", "``\u200b`")
+            return f"{status}\n```\n{tail}\n```" if tail else status
+
+        async def update():
+            shown = None
+            while True:
+                await asyncio.sleep(LIVE_EDIT_INTERVAL)
+                content = render(f"Running ({time.perf_counter() - start:.0f}s)...")
+                if content != shown:
+                    await message.edit(content=content)
+                    shown = content
+
+        task = asyncio.create_task(self.run_process(command, output))
+        self.processes[ctx.channel.id] = task
+        updater = asyncio.create_task(update())
+        try:
+            code = await task
+            status = f"Exited with code {code}"
+        except asyncio.TimeoutError:
+            status = "Killed by the timeout"
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            status = "Cancelled"
+        finally:
+            updater.cancel()
+            del self.processes[ctx.channel.id]
+
+        status = f"{status} after {time.perf_counter() - start:.1f}s."
+        text = "".join(output)
+        if len(text) <= LIVE_TAIL_SIZE:
+            await message.edit(content=render(status))
+        else:
+            await message.edit(content=status)
+            await self.send_output(ctx, text, filename="shell.txt")
+
+    @commands.command(name="shcancel")
+    async def shell_cancel(self, ctx):
+        """Kills the shell command running in this channel."""
+        task = self.processes.get(ctx.channel.id)
+        if task is None:
+            return await ctx.send("No command is running in this channel.")
+        task.cancel()
+
 
 def setup(bot):
     bot.add_cog(Admin(bot))
@@ -1,20 +1,36 @@
+import asyncio
 import inspect
-import io
+import logging
 import os
 from typing import Union
 from urllib.parse import quote
 
+import aiohttp
 import disnake
 from disnake.ext import commands
 
-from auth import WOLFRAM_APP_ID
+from utils.cache import DiskCache, SingleFlight
 from utils.converters import FetchedUser
+from utils.http import HTTPStatusError, ResponseTooLarge
 from utils.utility import red_tick
 
+logger = logging.getLogger("cogs.devtools")
+
+WOLFRAM_URL = "https://api.wolframalpha.com/v1/simple?appid={app_id}&i={query}"
+WOLFRAM_CACHE_DIR = "data/wolfram"
+WOLFRAM_CACHE_SIZE = 256 * 1024 * 1024  # bytes of images kept on disk
+
 
 class DevTools(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.wolfram_cache = DiskCache(
+            WOLFRAM_CACHE_DIR, WOLFRAM_CACHE_SIZE, suffix=".png"
+        )
+        self._wolfram_flights = SingleFlight()
+
+    def cache_sizes(self):
+        return {"wolfram_images": len(self.wolfram_cache)}
 
     @commands.command()
     async def oauth(self, ctx, bot: Union[disnake.User, FetchedUser], *perms):
@@ -135,18 +151,43 @@ class DevTools(commands.Cog):
     #             return
     #     await ctx.send(f"<{git_link}>")
 
+    async def fetch_wolfram(self, key, query):
+        """Returns the path of the rendered image for a query, downloading it to
+        the disk cache under key (the normalized query) if it isn't there."""
+        path = self.wolfram_cache.get(key)
+        if path is not None:
+            return path
+        from auth import WOLFRAM_APP_ID
+
+        url = WOLFRAM_URL.format(app_id=WOLFRAM_APP_ID, query=quote(query))
+        return await self.wolfram_cache.fill(
+            key, lambda fp: self.bot.session.download(url, fp)
+        )
+
     @commands.command()
     async def wolfram(self, ctx, *, query):
-        query_quoted = quote(query)
-        async with self.bot.session.get(
-            f"https://api.wolframalpha.com/v1/simple?appid={WOLFRAM_APP_ID}&i={query_quoted}"
-        ) as resp:
-            try:
-                img = await resp.read()
-            except Exception as e:
-                await ctx.send(f"```py\n{e.__class__}: {e}\n```")
+        # only the cache key is normalized, wolfram gets the query as typed
+        key = " ".join(query.casefold().split())
+        try:
+            # identical queries running at the same time share one download
+            path = await self._wolfram_flights.do(key, self.fetch_wolfram, key, query)
+        except HTTPStatusError as e:
+            logger.info(f"Wolfram query failed: {e}")
+            # wolfram answers 501 to anything it can't interpret
+            if e.status == 501:
+                return await ctx.send("Wolfram|Alpha didn't understand that query.")
+            return await ctx.send("Wolfram|Alpha request failed.")
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            ResponseTooLarge,
+            OSError,
+        ) as e:
+            # keep the details in the log, not in the channel
+            logger.warning(f"Wolfram query failed: {e.__class__.__name__}: {e}")
+            return await ctx.send("Wolfram|Alpha request failed.")
 
-            await ctx.send(file=disnake.File(io.BytesIO(img), filename="wolfram.png"))
+        await ctx.send(file=disnake.File(path, filename="wolfram.png"))
 
 
 def setup(bot):
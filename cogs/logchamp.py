@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+
+import disnake
+from disnake.ext import commands
+
+logger = logging.getLogger("cogs.logchamp")
+
+CONFIG_FILE = "logchamp.json"
+EVENTS = ("message_edit", "message_delete", "member_join", "member_remove")
+BATCH_WINDOW = 2  # seconds to collect log entries before posting them
+EMBEDS_PER_MESSAGE = 10  # discord's limits
+EMBED_CHARS_PER_MESSAGE = 6000
+FIELD_LIMIT = 1024
+BULK_DELETE_SHOWN = 10  # cached messages listed in a bulk delete entry
+
+
+def load_config(path=CONFIG_FILE):
+    """Returns (guild id, event -> tuple of log channel ids, ignored channel and
+    category ids) from a logchamp config file."""
+    with open(path) as fp:
+        config = json.load(fp)
+    routes = {}
+    for channel_id, events in config["LOGS"].items():
+        for event in events:
+            if event not in EVENTS:
+                raise ValueError(f"Unknown logchamp event {event!r}")
+            routes[event] = routes.get(event, ()) + (int(channel_id),)
+    ignore = frozenset(int(i) for i in config.get("MESSAGE_IGNORE", ()))
+    return int(config["GUILD"]), routes, ignore
+
+
+def truncate(text, limit=FIELD_LIMIT):
+    if not text:
+        return "*empty*"
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def pack_embeds(embeds):
+    """Splits embeds into groups that fit in one message."""
+    group, size = [], 0
+    for embed in embeds:
+        if group and (
+            len(group) == EMBEDS_PER_MESSAGE
+            or size + len(embed) > EMBED_CHARS_PER_MESSAGE
+        ):
+            yield group
+            group, size = [], 0
+        group.append(embed)
+        size += len(embed)
+    if group:
+        yield group
+
+
+class Logchamp(commands.Cog):
+    """Logs message edits and deletes and member joins and leaves to the channels
+    configured in logchamp.json. Entries are collected per log channel for
+    BATCH_WINDOW seconds and posted several embeds to a message."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.guild_id, self.routes, self.ignore = load_config()
+        # log channel id -> pending embeds waiting to be posted together
+        self._batches = {}
+        self._batch_handles = {}  # log channel id -> timer that flushes its batch
+        self._batch_tasks = set()
+        self._locks = {}  # log channel id -> lock, so batches post in order
+
+    def cog_unload(self):
+        # post pending entries now, so the timers don't fire on the unloaded cog
+        for handle in self._batch_handles.values():
+            handle.cancel()
+        pending = sum(map(len, self._batches.values()))
+        for channel_id, batch in list(self._batches.items()):
+            self._flush_batch(channel_id, batch)
+        if pending:
+            logger.info(f"Posting {pending} pending log entries on unload.")
+
+    def cache_sizes(self):
+        return {"pending": sum(map(len, self._batches.values()))}
+
+    def ignored(self, channel_id):
+        if channel_id in self.ignore:
+            return True
+        channel = self.bot.get_channel(channel_id)
+        return getattr(channel, "category_id", None) in self.ignore
+
+    def log(self, event, embed):
+        for channel_id in self.routes.get(event, ()):
+            batch = self._batches.get(channel_id)
+            if batch is None:
+                batch = self._batches[channel_id] = []
+                loop = asyncio.get_running_loop()
+                self._batch_handles[channel_id] = loop.call_later(
+                    BATCH_WINDOW, self._flush_batch, channel_id, batch
+                )
+            batch.append(embed)
+
+    def _flush_batch(self, channel_id, batch):
+        if self._batches.get(channel_id) is not batch:
+            return
+        del self._batches[channel_id]
+        self._batch_handles.pop(channel_id, None)
+        task = asyncio.create_task(self._send_batch(channel_id, batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, channel_id, batch):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return logger.warning(f"Log channel {channel_id} not found.")
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            for embeds in pack_embeds(batch):
+                try:
+                    await channel.send(embeds=embeds)
+                except disnake.HTTPException as e:
+                    logger.warning(
+                        f"Could not post {len(embeds)} log entries to {channel_id}: {e}"
+                    )
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        data = payload.data
+        if (
+            int(data.get("guild_id", 0)) != self.guild_id
+            or "message_edit" not in self.routes
+            # embed-only updates (link previews) don't have content
+            or "content" not in data
+            or data.get("author", {}).get("bot")
+            or self.ignored(payload.channel_id)
+        ):
+            return
+        before = payload.cached_message
+        if before is not None and before.content == data["content"]:
+            return
+        author = data.get("author", {})
+        embed = disnake.Embed(
+            color=disnake.Color.gold(),
+            description=(
+                f"**Message edited in <#{payload.channel_id}>** "
+                f"[jump](https://discord.com/channels/{self.guild_id}/"
+                f"{payload.channel_id}/{payload.message_id})"
+            ),
+            timestamp=disnake.utils.utcnow(),
+        )
+        embed.set_author(name=f"{author.get('username')} ({author.get('id')})")
+        embed.add_field(
+            name="Before",
+            value=truncate(before.content) if before else "*not cached*",
+            inline=False,
+        )
+        embed.add_field(name="After", value=truncate(data["content"]), inline=False)
+        embed.set_footer(text=f"Message {payload.message_id}")
+        self.log("message_edit", embed)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        if (
+            payload.guild_id != self.guild_id
+            or "message_delete" not in self.routes
+            or self.ignored(payload.channel_id)
+        ):
+            return
+        message = payload.cached_message
+        if message is not None and message.author.bot:
+            return
+        embed = disnake.Embed(
+            color=disnake.Color.red(),
+            description=f"**Message deleted in <#{payload.channel_id}>**",
+            timestamp=disnake.utils.utcnow(),
+        )
+        if message is None:
+            embed.add_field(name="Content", value="*not cached*", inline=False)
+        else:
+            embed.set_author(name=f"{message.author} ({message.author.id})")
+            embed.add_field(
+                name="Content", value=truncate(message.content), inline=False
+            )
+            if message.attachments:
+                embed.add_field(
+                    name="Attachments",
+                    value=truncate("\n".join(a.url for a in message.attachments)),
+                    inline=False,
+                )
+        embed.set_footer(text=f"Message {payload.message_id}")
+        self.log("message_delete", embed)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        if (
+            payload.guild_id != self.guild_id
+            or "message_delete" not in self.routes
+            or self.ignored(payload.channel_id)
+        ):
+            return
+        # one entry for the whole purge, however many messages it removed
+        cached = sorted(payload.cached_messages, key=lambda m: m.id)
+        embed = disnake.Embed(
+            color=disnake.Color.dark_red(),
+            description=(
+                f"**{len(payload.message_ids)} messages purged in "
+                f"<#{payload.channel_id}>** ({len(cached)} cached)"
+            ),
+            timestamp=disnake.utils.utcnow(),
+        )
+        lines = [
+            f"{m.author} ({m.author.id}): {m.content[:100]}"
+            for m in cached[-BULK_DELETE_SHOWN:]
+        ]
+        if lines:
+            embed.add_field(
+                name="Last messages", value=truncate("\n".join(lines)), inline=False
+            )
+        self.log("message_delete", embed)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        if member.guild.id != self.guild_id or "member_join" not in self.routes:
+            return
+        embed = disnake.Embed(
+            color=disnake.Color.green(),
+            description=f"**{member.mention} joined**",
+            timestamp=disnake.utils.utcnow(),
+        )
+        embed.set_author(name=f"{member} ({member.id})")
+        embed.add_field(
+            name="Account created",
+            value=disnake.utils.format_dt(member.created_at, "R"),
+        )
+        embed.set_footer(text=f"{member.guild.member_count} members")
+        self.log("member_join", embed)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if member.guild.id != self.guild_id or "member_remove" not in self.routes:
+            return
+        embed = disnake.Embed(
+            color=disnake.Color.orange(),
+            description=f"**{member.mention} left**",
+            timestamp=disnake.utils.utcnow(),
+        )
+        embed.set_author(name=f"{member} ({member.id})")
+        if member.joined_at:
+            embed.add_field(
+                name="Joined", value=disnake.utils.format_dt(member.joined_at, "R")
+            )
+        embed.set_footer(text=f"{member.guild.member_count} members")
+        self.log("member_remove", embed)
+
+
+def setup(bot):
+    bot.add_cog(Logchamp(bot))
@@ -8,27 +8,147 @@ from disnake.ext import commands
 
 from utils import settings
 from utils.converters import Language
+from utils.members import JoinIndex, MemberSnapshot
 from utils.parser import ARGS
 from utils.translate import Translate
 from utils.utility import fetch_previous_message
 
+ACCOUNT_AGE_BINS = [0, 1, 7, 30, 90, 365, float("inf")]  # days
+ACCOUNT_AGE_LABELS = ["<1d", "1-7d", "7-30d", "30-90d", "90d-1y", ">1y"]
+
+TRANSLATE_CACHE_FILE = "data/translate_cache.json"
+LANGUAGES_FILE = "data/languages.json"
+
 
 class Misc(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.translate_api = Translate()
+        self.translate_api = Translate(
+            cache_file=TRANSLATE_CACHE_FILE, lang_file=LANGUAGES_FILE
+        )
+        self.join_indexes = {}  # guild id -> JoinIndex
+        self.snapshots = {}  # guild id -> MemberSnapshot
+
+    def cog_unload(self):
+        self.translate_api.save_cache()
+
+    def cache_sizes(self):
+        return {
+            "translations": len(self.translate_api.cache),
+            "languages": len(self.translate_api.lang_cache),
+            "join_indexes": sum(map(len, self.join_indexes.values())),
+            "snapshots": sum(map(len, self.snapshots.values())),
+        }
 
     @commands.command()
     async def membercount(self, ctx):
         await ctx.send(ctx.guild.member_count)
 
+    def get_join_index(self, guild):
+        index = self.join_indexes.get(guild.id)
+        if index is None:
+            index = JoinIndex(guild.members)
+            # only keep it once the member list is complete, later joins/leaves update it
+            if guild.chunked:
+                self.join_indexes[guild.id] = index
+        return index
+
+    def get_snapshot(self, guild):
+        snapshot = self.snapshots.get(guild.id)
+        if snapshot is None:
+            snapshot = MemberSnapshot(guild.members)
+            if guild.chunked:
+                self.snapshots[guild.id] = snapshot
+        return snapshot
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        index = self.join_indexes.get(member.guild.id)
+        if index is not None:
+            index.add(member)
+        snapshot = self.snapshots.get(member.guild.id)
+        if snapshot is not None:
+            snapshot.add(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        index = self.join_indexes.get(member.guild.id)
+        if index is not None:
+            index.remove(member.id)
+        snapshot = self.snapshots.get(member.guild.id)
+        if snapshot is not None:
+            snapshot.remove(member.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        snapshot = self.snapshots.get(after.guild.id)
+        if snapshot is not None and before.roles != after.roles:
+            snapshot.update(after)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        snapshot = self.snapshots.get(role.guild.id)
+        if snapshot is not None:
+            snapshot.remove_role(role.id)
+
     @commands.command()
     async def joinpos(self, ctx, member: disnake.Member = None):
         member = member if member else ctx.author
-        order = sorted(ctx.guild.members, key=lambda m: m.joined_at)
-        join_pos = order.index(member) + 1
+        join_pos = self.get_join_index(ctx.guild).position(member.id)
+        if join_pos is None:
+            return await ctx.send("Join position unavailable.")
         await ctx.send(join_pos)
 
+    @commands.command()
+    async def whojoined(self, ctx, position: int):
+        """Shows which member joined at a given join position."""
+        member_id = self.get_join_index(ctx.guild).member_at(position)
+        member = ctx.guild.get_member(member_id) if member_id else None
+        if not member:
+            return await ctx.send(f"No member at join position {position}.")
+        await ctx.send(f"{member} (`{member.id}`)")
+
+    @commands.group(invoke_without_command=True)
+    async def memberstats(self, ctx):
+        """Member statistics for this server."""
+        await ctx.send_help(self.memberstats)
+
+    @memberstats.command(name="joins")
+    async def memberstats_joins(self, ctx, days: int = 14):
+        """Number of members who joined on each of the last few days."""
+        days = max(1, min(days, 60))
+        counts = self.get_snapshot(ctx.guild).joins_per_day(days)
+        # buckets are 24h windows ending now, newest last
+        lines = [f"{days - 1 - i:>2}d ago: {count}" for i, count in enumerate(counts)]
+        await ctx.send("__Joins per day__:```\n" + "\n".join(lines) + "\n```")
+
+    @memberstats.command(name="ages")
+    async def memberstats_ages(self, ctx, days: int = 7):
+        """Account age at join time of members who joined in the last few days."""
+        counts = self.get_snapshot(ctx.guild).account_ages(days, ACCOUNT_AGE_BINS)
+        lines = [
+            f"{label:>7}: {count}" for label, count in zip(ACCOUNT_AGE_LABELS, counts)
+        ]
+        await ctx.send(
+            f"__Account ages of members who joined in the last {days} days__:```\n"
+            + "\n".join(lines)
+            + "\n```"
+        )
+
+    @memberstats.command(name="roles")
+    async def memberstats_roles(self, ctx, top: int = 15):
+        """Most populated roles in this server."""
+        top = max(1, min(top, 25))
+        counts = self.get_snapshot(ctx.guild).role_counts()
+        lines = []
+        for role_id, count in sorted(counts.items(), key=lambda t: -t[1])[:top]:
+            role = ctx.guild.get_role(role_id)
+            if role and not role.is_default():
+                lines.append(f"{role.name}: {count}")
+        # role names can be 100 characters long
+        text = "\n".join(lines)[:1950]
+        await ctx.send("__Role population__:```\n" + text + "\n```")
+
     @commands.command()
     async def test(self, ctx):
         hostname = socket.gethostname()
@@ -69,11 +189,56 @@ class Misc(commands.Cog):
                 if ref.cached_message:
                     text = ref.cached_message.content
             if not text:
-                prev = await fetch_previous_message(ctx.message)
+                prev = await fetch_previous_message(
+                    ctx.message,
+                    cache=self.bot.cached_messages,
+                    index=self.bot.message_index,
+                )
+                if not prev:
+                    return await ctx.send("Couldn't find a message to translate.")
                 text = prev.content
         translation, from_lang = await self.translate_api.translate(text, lang=lang)
         await ctx.send(f"({from_lang}->{lang}) {translation}")
 
+    @commands.command(aliases=["th"])
+    async def translatehistory(
+        self,
+        ctx,
+        count: typing.Optional[int] = 5,
+        lang: typing.Optional[Language] = "en",
+    ):
+        """Translates the last few messages in this channel. Defaults to 5 messages, at most 25."""
+        count = max(1, min(count, 25))
+        messages = [
+            m
+            async for m in ctx.channel.history(limit=count, before=ctx.message)
+            if m.content
+        ]
+        if not messages:
+            return await ctx.send("No messages to translate.")
+        messages.reverse()
+
+        lang = lang or "en"
+        results = await self.translate_api.translate_many(
+            [m.clean_content for m in messages], lang=lang, return_exceptions=True
+        )
+        content = ""
+        for message, result in zip(messages, results):
+            if isinstance(result, Exception):
+                line = f"**{message.author}** *couldn't be translated*\n"
+            else:
+                translation, from_lang = result
+                line = f"**{message.author}** ({from_lang}->{lang}) {translation}\n"
+            # lines can be longer than a message themselves, split those up
+            for i in range(0, len(line), 2000):
+                part = line[i : i + 2000]
+                if content and len(content) + len(part) > 2000:
+                    await ctx.send(content)
+                    content = ""
+                content += part
+        if content:
+            await ctx.send(content)
+
 
 def setup(bot):
     bot.add_cog(Misc(bot))
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import logging
+import math
+import time
+
+import disnake
+import psutil
+from disnake.ext import commands, tasks
+
+from utils import settings
+from utils.checks import is_admin
+
+logger = logging.getLogger("cogs.monitor")
+
+SPARK = "▁▂▃▄▅▆▇█"
+# sample fields shown by the monitor command, with their units
+FIELDS = {
+    "rss_mb": "MiB",
+    "cpu_percent": "%",
+    "open_fds": "",
+    "threads": "",
+    "tasks": "",
+    "loop_lag_ms": "ms",
+    "latency_ms": "ms",
+    "events_per_s": "/s",
+}
+
+
+def sparkline(values):
+    values = [v for v in values if v is not None and math.isfinite(v)]
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    scale = (len(SPARK) - 1) / (high - low) if high > low else 0
+    return "".join(SPARK[int((v - low) * scale)] for v in values)
+
+
+class Monitor(commands.Cog):
+    """Samples the bot's resource usage into a ring buffer and alerts when it
+    crosses settings.MONITOR_THRESHOLDS."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.process = psutil.Process()
+        self.process.cpu_percent()  # the first call only sets the baseline
+        self.history = collections.deque(maxlen=settings.MONITOR_HISTORY)
+        self.last_alerts = {}  # field -> time of the last alert about it
+        self._last_lag = (0.0, 0)  # loop lag histogram (sum, count) at the last sample
+        self._last_events = (time.perf_counter(), 0)
+        self.sample_task.change_interval(seconds=settings.MONITOR_INTERVAL)
+        self.sample_task.start()
+
+    def cog_unload(self):
+        self.sample_task.cancel()
+
+    def cog_check(self, ctx):
+        return is_admin(ctx.author)
+
+    def cache_sizes(self):
+        """Entry counts of the bot's caches, plus whatever cogs report through
+        their own cache_sizes methods."""
+        sizes = {
+            "members": sum(len(guild.members) for guild in self.bot.guilds),
+            "users": len(self.bot.users),
+            "messages": len(self.bot.cached_messages),
+            "message_index": len(self.bot.message_index),
+            "resolver": len(self.bot.resolver.cache),
+        }
+        for name, cog in self.bot.cogs.items():
+            if cog is not self and hasattr(cog, "cache_sizes"):
+                for key, size in cog.cache_sizes().items():
+                    sizes[f"{name}.{key}"] = size
+        return sizes
+
+    def sample(self):
+        with self.process.oneshot():
+            memory = self.process.memory_info()
+            cpu = self.process.cpu_percent()
+            threads = self.process.num_threads()
+            if hasattr(self.process, "num_fds"):
+                fds = self.process.num_fds()
+            else:
+                fds = self.process.num_handles()
+
+        # mean event loop lag since the last sample
+        lag = self.bot.metrics.loop_lag
+        lag_sum, lag_count = self._last_lag
+        self._last_lag = (lag.sum, lag.count)
+        loop_lag = (
+            (lag.sum - lag_sum) / (lag.count - lag_count)
+            if lag.count > lag_count
+            else 0.0
+        )
+
+        now = time.perf_counter()
+        events = self.bot.metrics.counters.get("events_dispatched", 0)
+        last_time, last_events = self._last_events
+        self._last_events = (now, events)
+
+        return {
+            "time": time.time(),
+            "rss_mb": memory.rss / 1024 / 1024,
+            "cpu_percent": cpu,
+            "open_fds": fds,
+            "threads": threads,
+            "tasks": len(asyncio.all_tasks()),
+            "loop_lag_ms": loop_lag * 1000,
+            "latency_ms": self.bot.latency * 1000,
+            "events_per_s": (events - last_events) / (now - last_time),
+            "caches": self.cache_sizes(),
+        }
+
+    @tasks.loop(seconds=30)
+    async def sample_task(self):
+        try:
+            sample = self.sample()
+        except (psutil.Error, OSError) as e:
+            return logger.warning(f"Could not sample resource usage: {e}")
+        self.history.append(sample)
+        await self.check_thresholds(sample)
+
+    async def check_thresholds(self, sample):
+        exceeded = [
+            (field, sample[field], limit)
+            for field, limit in settings.MONITOR_THRESHOLDS.items()
+            if math.isfinite(sample[field]) and sample[field] > limit
+        ]
+        now = time.time()
+        for field, value, limit in exceeded:
+            last = self.last_alerts.get(field)
+            if last is not None and now - last < settings.MONITOR_ALERT_COOLDOWN:
+                continue
+            self.last_alerts[field] = now
+            message = f"{field} is {value:.1f}{FIELDS[field]} (limit {limit})"
+            logger.warning(f"Resource alert: {message}")
+            channel = self.bot.get_channel(settings.MONITOR_ALERT_CHANNEL or 0)
+            if channel is not None:
+                try:
+                    await channel.send(f":warning: Resource alert: {message}")
+                except disnake.HTTPException as e:
+                    logger.warning(f"Could not send resource alert: {e}")
+
+    @commands.group(invoke_without_command=True)
+    async def monitor(self, ctx, samples: int = 60):
+        """Shows recent resource usage history."""
+        history = list(self.history)[-samples:]
+        if not history:
+            return await ctx.send("No samples yet.")
+        minutes = (history[-1]["time"] - history[0]["time"]) / 60
+        lines = [
+            f"Last {len(history)} samples ({minutes:.0f} minutes), "
+            f"cache profile {self.bot.cache_profile}:"
+        ]
+        for field, unit in FIELDS.items():
+            values = [sample[field] for sample in history]
+            finite = [v for v in values if math.isfinite(v)]
+            if not finite:
+                continue
+            lines.append(
+                f"{field:<13} now {values[-1]:>8.1f}{unit:<3} "
+                f"max {max(finite):>8.1f}{unit:<3} {sparkline(values)}"
+            )
+        await ctx.send("```\n" + "\n".join(lines)[:1980] + "\n```")
+
+    @monitor.command(name="caches")
+    async def monitor_caches(self, ctx):
+        """Shows the current size of the bot's caches."""
+        sizes = self.cache_sizes()
+        width = max(map(len, sizes))
+        lines = [f"{name:<{width}} {size:>9}" for name, size in sorted(sizes.items())]
+        await ctx.send("```\n" + "\n".join(lines)[:1980] + "\n```")
+
+
+def setup(bot):
+    bot.add_cog(Monitor(bot))
@@ -12,6 +12,16 @@ from disnake.ext import commands, tasks
 from utils.argparse_but_better import ArgumentParser
 from utils.checks import is_admin, is_mod
 from utils.converters import FetchedUser
+from utils.http import ResponseTooLarge
+from utils.journal import (
+    Journal,
+    ReplayObject,
+    member_record,
+    message_record,
+    read_journal,
+    replay,
+)
+from utils.resolver import BulkResolution, iter_tokens
 
 logger = logging.getLogger("cogs.raid")
 
@@ -37,6 +47,14 @@ ROLES = [
 BAD_NOODLE = 541810707386335234
 
 CACHE_REMOVE_AGE_THRESHOLD = 30  # minutes
+INVITE_UPDATE_DELAY = 2  # seconds to wait for invite uses to update after a join
+INVITE_REGEX = re.compile(r"(?:https?://)?discord.(?:com/invite|gg)/\w+")
+MBAN_MAX_SIZE = 4 * 1024 * 1024  # bytes, for mban file/url
+MBAN_MAX_IDS = 50000
+MBAN_PROGRESS_INTERVAL = 250  # bans between progress message edits
+# the list is read while banning, which can take far longer than the session's
+# total timeout, so only time out on a stalled connection
+MBAN_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
 
 
 async def confirm_action(ctx, prompt):
@@ -65,6 +83,84 @@ class TimeDelta(commands.Converter):
         return self.convert_to_time(argument)
 
 
+def flag_messages(
+    messages,
+    channel=None,
+    now=None,
+    approx_msg_time=None,
+    approx_join_time=None,
+    msg_content=None,
+    mention_count_threshold=None,
+    msg_contains_invite=False,
+):
+    """Checks cached messages against the raid cleanup criteria.
+    Returns (ids of flagged members, flagged messages)."""
+    now = now or disnake.utils.utcnow()
+
+    flagged_members = set()
+    ignored_members = set()
+    flagged_messages = set()
+
+    for message in messages:
+        # by id, so replayed messages (whose channels are stand-ins) match too
+        if not channel or message.channel.id == channel.id:
+
+            logger.debug(f"checking message {message.id} by user {message.author.id}")
+
+            # check reasons to ignore a user/message
+            if message.author.id in ignored_members:  # members who are safe
+                logger.debug("  member in ignored_members")
+                continue
+            if any(
+                (role.id not in ROLES) for role in message.author.roles
+            ):  # if they have any roles not in this list, they're safe.
+                logger.debug("  member has roles not in ROLES")
+                ignored_members.add(message.author.id)
+                continue
+            if (
+                approx_join_time and (now - message.author.joined_at) > approx_join_time
+            ):  # ignore old users
+                logger.debug("  member is ignored due to account age")
+                ignored_members.add(message.author.id)
+                continue
+            if (
+                approx_msg_time and (now - message.created_at) > approx_msg_time
+            ):  # ignore old messages
+                logger.debug("  message is ignored due to message age")
+                continue
+
+            # check message against flag criteria
+            logger.debug("  checking message against flag criteria")
+            if mention_count_threshold:
+                if len(message.mentions) >= mention_count_threshold:
+                    logger.debug("    message flagged by mention_count_threshold")
+                    flagged_messages.add(message)
+                    flagged_members.add(message.author.id)
+                    continue
+            if msg_contains_invite:
+                if INVITE_REGEX.search(message.content.lower()):
+                    logger.debug("    message flagged by msg_contains_invite")
+                    flagged_messages.add(message)
+                    flagged_members.add(message.author.id)
+                    continue
+            if msg_content:
+                if msg_content in message.content.lower():
+                    logger.debug("    message flagged by msg_content")
+                    flagged_messages.add(message)
+                    flagged_members.add(message.author.id)
+                    continue
+
+            # process messages here, dump text file with list of IDs of suspected members involved in raid.
+            #  - scan requested duration, whole cache otherwise (make it an approximate duration)
+            #  - common content
+            #  - presence of keywords
+            #  - similar join time?
+            #  - joined with same invite?
+            #  - ignore members > some role
+
+    return flagged_members, flagged_messages
+
+
 class WARNING_EXPERIMENTAL(commands.Cog):
     """EXTREMELY experimental raid-processing code. Do not play with this cog please."""
 
@@ -73,6 +169,8 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         self.cached_messages = []  # stores last 10 min of message events
         self.cached_joins = []  # stores last 10 min of join events
         self.cached_invites = {}  # recently used invites (map to amount of times used)
+        # (code, timestamp) of invite uses loaded by raid cache replay
+        self.replayed_invites = set()
 
         # TODO: maybe also add:
         # self.cached_authors = []    # recently active members
@@ -80,11 +178,26 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         self.last_invite_state = {}
         self.last_cache_update = None
 
+        # everything the raid cache sees, plus mod actions, for offline replay
+        self.journal = Journal("raid")
+        self.journal.start()
+
         self.clean_raid_cache_task.start()
 
+    def cog_unload(self):
+        self.clean_raid_cache_task.cancel()
+        self.journal.stop()
+
     def cog_check(self, ctx):
         return is_admin(ctx.author)
 
+    def cache_sizes(self):
+        return {
+            "messages": len(self.cached_messages),
+            "joins": len(self.cached_joins),
+            "invites": len(self.cached_invites),
+        }
+
     @commands.Cog.listener()
     async def on_ready(self):
         # setup invite state (for invite tracking)
@@ -98,6 +211,7 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         if message.guild.id != BIKINI_BOTTOM:
             return
         self.cached_messages.append(message)
+        self.journal.write("message", **message_record(message))
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
@@ -106,8 +220,11 @@ class WARNING_EXPERIMENTAL(commands.Cog):
 
         # update join cache
         self.cached_joins.append(member)
+        self.journal.write(
+            "join", guild_id=member.guild.id, member=member_record(member)
+        )
 
-        await asyncio.sleep(2)
+        await asyncio.sleep(INVITE_UPDATE_DELAY)
 
         if not self.last_invite_state:
             self.last_invite_state = dict(
@@ -119,35 +236,45 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         new_invite_state = dict(
             [(invite.code, invite.uses) for invite in await member.guild.invites()]
         )
+        deltas = {}
         for code, uses in new_invite_state.items():
             old_uses = self.last_invite_state.get(code, 0)
             if old_uses < uses:
                 if code not in self.cached_invites.keys():
                     self.cached_invites[code] = []
                 for i in range(uses - old_uses):
-                    self.cached_invites[code].append(datetime.datetime.now())
+                    self.cached_invites[code].append(disnake.utils.utcnow())
+                deltas[code] = uses - old_uses
+        if deltas:
+            self.journal.write("invites", deltas=deltas)
 
         self.last_invite_state = new_invite_state
 
     @tasks.loop(minutes=5)
     async def clean_raid_cache_task(self):
-        """Runs every 5 minutes, clears cached items older than 10 minutes."""
+        """Runs every 5 minutes, clears cached items older than
+        CACHE_REMOVE_AGE_THRESHOLD minutes. Replayed items are kept until
+        raid cache clear removes them, since they're usually older than that."""
         age_threshold = datetime.timedelta(minutes=CACHE_REMOVE_AGE_THRESHOLD)
-        await self.clean_raid_cache(age_threshold)
+        await self.clean_raid_cache(age_threshold, keep_replayed=True)
 
-    async def clean_raid_cache(self, age_threshold):
-        now = datetime.datetime.now()
+    async def clean_raid_cache(self, age_threshold, keep_replayed=False):
+        now = disnake.utils.utcnow()
         self.last_cache_update = now
         n = 0
 
         # clear message cache
         for message in list(self.cached_messages):
+            if keep_replayed and isinstance(message, ReplayObject):
+                continue
             if now - message.created_at >= age_threshold:
                 self.cached_messages.remove(message)
                 n += 1
 
         # clear join cache
         for member in list(self.cached_joins):
+            if keep_replayed and isinstance(member, ReplayObject):
+                continue
             if now - member.joined_at >= age_threshold:
                 self.cached_joins.remove(member)
                 n += 1
@@ -155,8 +282,11 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         # clear invite cache
         for code, join_list in list(self.cached_invites.items()):
             for timestamp in list(join_list):
+                if keep_replayed and (code, timestamp) in self.replayed_invites:
+                    continue
                 if now - timestamp >= age_threshold:
                     join_list.remove(timestamp)
+                    self.replayed_invites.discard((code, timestamp))
                     n += 1
             if len(join_list) == 0:
                 self.cached_invites.pop(code)
@@ -187,10 +317,35 @@ class WARNING_EXPERIMENTAL(commands.Cog):
         n = await self.clean_raid_cache(age_limit)
         await ctx.send(f"Cleared {n} items.")
 
+    @raid_cache.command(name="replay")
+    async def raid_cache_replay(self, ctx, *paths):
+        """Load raid journal files (default: the current one) into the raid cache.
+        Replayed items stay cached until raid cache clear removes them."""
+        paths = paths or [self.journal.path]
+        if not paths[0]:
+            return await ctx.send("Nothing has been journaled yet.")
+        loop = asyncio.get_running_loop()
+        try:
+            # journal files can be large, read and parse them off the event loop
+            messages, joins, invites = await loop.run_in_executor(
+                None, lambda: replay(read_journal(paths))
+            )
+        except OSError as e:
+            return await ctx.send(f"```py\n{e.__class__.__name__}: {e}\n```")
+        self.cached_messages.extend(messages)
+        self.cached_joins.extend(joins)
+        for code, timestamps in invites.items():
+            self.cached_invites.setdefault(code, []).extend(timestamps)
+            self.replayed_invites.update((code, when) for when in timestamps)
+        await ctx.send(
+            f"Replayed {len(messages)} messages, {len(joins)} joins "
+            f"and {sum(map(len, invites.values()))} invite uses."
+        )
+
     @raid.command(name="check")
     async def raid_check_invites(self, ctx):
         """Run some diagnostics on recent joins and return any notable information."""
-        now = datetime.datetime.now()
+        now = disnake.utils.utcnow()
         join_count = len(self.cached_joins)
         invite_count = len(self.cached_invites)
         analysis = (
@@ -283,72 +438,18 @@ class WARNING_EXPERIMENTAL(commands.Cog):
             f")\n```"
         )
 
-        now = datetime.datetime.now()
-
-        flagged_members = set()
-        ignored_members = set()
-        flagged_messages = set()
-
-        invite_regex = re.compile(r"(?:https?://)?discord.(?:com/invite|gg)/\w+")
-
-        for message in self.cached_messages.copy():
-            if not channel or message.channel == channel:
-
-                logger.debug(
-                    f"checking message {message.id} by user {message.author.id}"
-                )
+        now = disnake.utils.utcnow()
 
-                # check reasons to ignore a user/message
-                if message.author.id in ignored_members:  # members who are safe
-                    logger.debug("  member in ignored_members")
-                    continue
-                if any(
-                    (role.id not in ROLES) for role in message.author.roles
-                ):  # if they have any roles not in this list, they're safe.
-                    logger.debug("  member has roles not in ROLES")
-                    ignored_members.add(message.author.id)
-                    continue
-                if (
-                    approx_join_time
-                    and (now - message.author.joined_at) > approx_join_time
-                ):  # ignore old users
-                    logger.debug("  member is ignored due to account age")
-                    ignored_members.add(message.author)
-                    continue
-                if (
-                    approx_msg_time and (now - message.created_at) > approx_msg_time
-                ):  # ignore old messages
-                    logger.debug("  message is ignored due to message age")
-                    continue
-
-                # check message against flag criteria
-                logger.debug("  checking message against flag criteria")
-                if mention_count_threshold:
-                    if len(message.mentions) >= mention_count_threshold:
-                        logger.debug("    message flagged by mention_count_threshold")
-                        flagged_messages.add(message)
-                        flagged_members.add(message.author.id)
-                        continue
-                if msg_contains_invite:
-                    if invite_regex.search(message.content.lower()):
-                        logger.debug("    message flagged by msg_contains_invite")
-                        flagged_messages.add(message)
-                        flagged_members.add(message.author.id)
-                        continue
-                if msg_content:
-                    if msg_content in message.content.lower():
-                        logger.debug("    message flagged by msg_content")
-                        flagged_messages.add(message)
-                        flagged_members.add(message.author.id)
-                        continue
-
-                # process messages here, dump text file with list of IDs of suspected members involved in raid.
-                #  - scan requested duration, whole cache otherwise (make it an approximate duration)
-                #  - common content
-                #  - presence of keywords
-                #  - similar join time?
-                #  - joined with same invite?
-                #  - ignore members > some role
+        flagged_members, flagged_messages = flag_messages(
+            self.cached_messages.copy(),
+            channel=channel,
+            now=now,
+            approx_msg_time=approx_msg_time,
+            approx_join_time=approx_join_time,
+            msg_content=msg_content,
+            mention_count_threshold=mention_count_threshold,
+            msg_contains_invite=msg_contains_invite,
+        )
 
         text = "\n".join([str(i) for i in flagged_members])
         fp = io.StringIO(text)
@@ -468,69 +569,124 @@ class WARNING_EXPERIMENTAL(commands.Cog):
             ban_at_end=False,
         )
 
+    async def ban_one(self, ctx, user):
+        """Bans for a mass ban, returns whether it worked."""
+        reason = f"Mass ban by {ctx.author}"
+        try:
+            await ctx.guild.ban(user, reason=reason)
+        except disnake.DiscordException:
+            return False
+        self.journal.write(
+            "action",
+            action="ban",
+            user_id=user.id,
+            moderator_id=ctx.author.id,
+            reason=reason,
+        )
+        return True
+
     async def execute_massban(self, ctx, users):
+        """Bans everyone in a BulkResolution after confirmation."""
+        if users.invalid or users.duplicates:
+            invalid = ", ".join(f"`{token}`" for token in users.invalid[:10])
+            await ctx.send(
+                f"Skipping {len(users.invalid)} invalid entries and "
+                f"{len(users.duplicates)} duplicate ids. {invalid}"[:2000]
+            )
         confirmation = await confirm_action(
-            ctx, f"Are you sure you would like to ban {len(users)} users?"
+            ctx,
+            f"Are you sure you would like to ban {len(users)} users? "
+            f"({users.summary()})",
         )
 
         if confirmation:
             await ctx.send("Banning...")
             success = 0
             failed = 0
-            for user in users:
-                if isinstance(user, str):
-                    user = int(user)
-                if isinstance(user, int):
-                    user = disnake.Object(user)
-                try:
-                    await ctx.guild.ban(user, reason=f"Mass ban by {ctx.author}")
+            for user in users.targets:
+                if await self.ban_one(ctx, user):
                     success += 1
-                except disnake.DiscordException:
+                else:
                     failed += 1
             await ctx.send(f"Done. {success} successes, {failed} failures.")
 
         else:
             await ctx.send("Cancelled!")
 
+    async def execute_streaming_massban(self, ctx, source, chunks):
+        """Bans every id in a streamed list as soon as it's parsed, after confirmation.
+        Stops at MBAN_MAX_IDS ids, or when the stream fails or gets too big."""
+        confirmation = await confirm_action(
+            ctx,
+            f"Are you sure you would like to ban every user listed in {source}? "
+            f"Banning starts while the list is read, up to {MBAN_MAX_IDS} users.",
+        )
+        if not confirmation:
+            return await ctx.send("Cancelled!")
+
+        status = await ctx.send("Banning...")
+        users = BulkResolution()
+        success = 0
+        failed = 0
+        error = None
+        try:
+            async for token in iter_tokens(chunks):
+                user = users.add(token, ctx.guild)
+                if user is None:
+                    continue
+                if len(users) > MBAN_MAX_IDS:
+                    error = f"Stopped at the limit of {MBAN_MAX_IDS} users."
+                    break
+                if await self.ban_one(ctx, user):
+                    success += 1
+                else:
+                    failed += 1
+                if (success + failed) % MBAN_PROGRESS_INTERVAL == 0:
+                    await status.edit(
+                        content=f"Banning... {success} successes, {failed} failures."
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError, ResponseTooLarge) as e:
+            error = f"Stopped reading: `{e.__class__.__name__}: {e}`"
+        finally:
+            await chunks.aclose()
+
+        await ctx.send(
+            f"Done. {success} successes, {failed} failures, "
+            f"{len(users.invalid)} invalid entries, "
+            f"{len(users.duplicates)} duplicates. {error or ''}"
+        )
+
     @commands.group(invoke_without_command=True)
-    async def mban(self, ctx, *users: Union[disnake.Member, disnake.User, int]):
-        """Bans a list of users"""
+    async def mban(self, ctx, *users):
+        """Bans a list of users (ids or mentions)"""
+        users = await self.bot.resolver.resolve_many(ctx.guild, users)
         await self.execute_massban(ctx, users)
 
     @mban.command(name="file")
     async def mban_file(self, ctx):
         """Mass bans users from a text file."""
-        try:
-            users = (await ctx.message.attachments[0].read()).decode().split()
-        except Exception as e:
+        if not ctx.message.attachments:
+            return await ctx.send("Attach a text file with the ids to ban.")
+        attachment = ctx.message.attachments[0]
+        if attachment.size > MBAN_MAX_SIZE:
             return await ctx.send(
-                f"Failed to read file: ```py\n{e.__class__.__name__}: {e}\n```"
+                f"That file is too large, the limit is {MBAN_MAX_SIZE} bytes."
             )
 
-        await self.execute_massban(ctx, users)
+        chunks = self.bot.session.stream(
+            attachment.url, max_size=MBAN_MAX_SIZE, timeout=MBAN_TIMEOUT
+        )
+        await self.execute_streaming_massban(ctx, f"`{attachment.filename}`", chunks)
 
     @mban.command(name="url")
     async def mban_url(self, ctx, url):
         """Mass bans from a pastebin URL. Must be the RAW text url."""
-        confirmation = await confirm_action(
-            ctx, "Are you sure this is a valid URL? (Must be the **raw** text!)"
+        chunks = self.bot.session.stream(
+            url, max_size=MBAN_MAX_SIZE, timeout=MBAN_TIMEOUT
+        )
+        await self.execute_streaming_massban(
+            ctx, f"<{url}> (must be the **raw** text!)", chunks
         )
-
-        if confirmation:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as resp:
-                        text = await resp.text()
-                        users = text.split()
-            except Exception as e:
-                return await ctx.send(
-                    f"Failed to read url: ```py\n{e.__class__.__name__}: {e}\n```"
-                )
-
-            await self.execute_massban(ctx, users)
-
-        else:
-            await ctx.send("Cancelled!")
 
     @commands.group(name="invites", aliases=["invite"], invoke_without_command=True)
     async def invites(self, ctx, code=None):
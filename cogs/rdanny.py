@@ -1,3 +1,4 @@
+import asyncio
 import io
 import logging
 import os
@@ -8,8 +9,13 @@ import aiohttp
 import disnake
 from disnake.ext import commands
 
+from utils.cache import LRUCache
+from utils.http import ResponseTooLarge
+
 logger = logging.getLogger("cogs.rdanny")
 
+RTFM_RESULT_CACHE_SIZE = 512
+
 
 def finder(text, collection, *, key=None, lazy=True):
     suggestions = []
@@ -78,6 +84,15 @@ class RDanny(commands.Cog):
         self.bot = bot
         self.issue = re.compile(r"##(?P<number>[0-9]+)")
         self._recently_blocked = set()
+        # (inventory key, normalized query) -> top matches
+        self._rtfm_results = LRUCache(RTFM_RESULT_CACHE_SIZE)
+
+    def cache_sizes(self):
+        tables = getattr(self, "_rtfm_cache", {})
+        return {
+            "rtfm_entries": sum(map(len, tables.values())),
+            "rtfm_results": len(self._rtfm_results),
+        }
 
     def parse_object_inv(self, stream, url):
         # key: URL
@@ -138,16 +153,18 @@ class RDanny(commands.Cog):
         cache = {}
         for key, page in page_types.items():
             sub = cache[key] = {}
-            async with self.bot.session.get(page + "/objects.inv") as resp:
-                if resp.status != 200:
-                    raise RuntimeError(
-                        "Cannot build rtfm lookup table, try again later."
-                    )
+            try:
+                data = await self.bot.session.read(page + "/objects.inv")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ResponseTooLarge):
+                raise RuntimeError(
+                    "Cannot build rtfm lookup table, try again later."
+                ) from None
 
-                stream = SphinxObjectFileReader(await resp.read())
-                cache[key] = self.parse_object_inv(stream, page)
+            stream = SphinxObjectFileReader(data)
+            cache[key] = self.parse_object_inv(stream, page)
 
         self._rtfm_cache = cache
+        self._rtfm_results.clear()
 
     async def do_rtfm(self, ctx, key, obj):
         page_types = {
@@ -177,12 +194,13 @@ class RDanny(commands.Cog):
                     obj = f"abc.Messageable.{name}"
                     break
 
-        cache = list(self._rtfm_cache[key].items())
-
-        def transform(tup):
-            return tup[0]
-
-        matches = finder(obj, cache, key=lambda t: t[0], lazy=False)[:8]
+        # finder() is case-insensitive, so the lowercased query gives the same matches
+        cache_key = (key, obj.lower())
+        matches = self._rtfm_results.get(cache_key)
+        if matches is None:
+            cache = list(self._rtfm_cache[key].items())
+            matches = finder(obj, cache, key=lambda t: t[0], lazy=False)[:8]
+            self._rtfm_results.set(cache_key, matches)
 
         e = disnake.Embed(colour=disnake.Colour.blurple())
         if len(matches) == 0:
@@ -210,6 +228,11 @@ class RDanny(commands.Cog):
         key = self.transform_rtfm_language_key(ctx, "latest")
         await self.do_rtfm(ctx, key, obj)
 
+    @rtfm.command(name="cachestats", hidden=True)
+    async def rtfm_cachestats(self, ctx):
+        """Shows how often rtfm lookups are served from the result cache."""
+        await ctx.send(f"rtfm result cache: {self._rtfm_results.stats()}")
+
     # @rtfm.command(name="jp")
     # async def rtfm_jp(self, ctx, *, obj: str = None):
     #     """Gives you a documentation link for a discord.py entity (Japanese)."""
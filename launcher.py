@@ -2,16 +2,22 @@ import datetime
 import logging
 from os import environ
 
-from bot import Squire
 from utils.parser import ARGS
-from utils.utility import setup_logger
+from utils.startup import ImportProfiler, StartupTimer
+
+startup = StartupTimer()
+if ARGS.profile_startup:
+    ImportProfiler(startup).install()
+
+with startup.measure("import", "bot"):
+    from bot import Squire
+with startup.measure("import", "utils"):
+    from utils import settings
+    from utils.utility import setup_logger
 
 logger = logging.getLogger("launcher")
 started_at = datetime.datetime.now()
 
-# TOKEN = environ.get("TOKEN")
-from auth import TOKEN
-
 
 def main():
 
@@ -24,11 +30,20 @@ def main():
     setup_logger("utils", debug, started_at)
 
     logger.info(f"Initializing bot.")
-    bot = Squire(started_at)
+    bot = Squire(started_at, startup=startup)
 
     logger.info("Loading cogs.")
     bot.load_cogs()
 
+    if ARGS.profile_startup and ARGS.no_connect:
+        bot.load_cogs(deferred=True)
+        exit(check_startup_budget(bot))
+
+    # credentials are only needed to log in, --no-connect runs without them
+    # TOKEN = environ.get("TOKEN")
+    with startup.measure("import", "auth"):
+        from auth import TOKEN
+
     logger.info("Starting bot.")
     try:
         bot.run(TOKEN)
@@ -42,5 +57,19 @@ def main():
         exit(exit_code)
 
 
+def check_startup_budget(bot):
+    """Writes the startup report, returns 1 if startup went over budget."""
+    path = bot.write_startup_report()
+    budget = ARGS.startup_budget
+    if budget is None:
+        budget = settings.STARTUP_BUDGET
+    spent = startup.total("import") + startup.total("cog")
+    if spent > budget:
+        logger.error(f"Startup took {spent:.3f}s, over the {budget}s budget. ({path})")
+        return 1
+    logger.info(f"Startup took {spent:.3f}s, within the {budget}s budget. ({path})")
+    return 0
+
+
 if __name__ == "__main__":
     main()
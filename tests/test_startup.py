@@ -0,0 +1,62 @@
+"""Startup budget check: runs `launcher.py --profile-startup --no-connect` the way
+CI would, with no credentials and no network, and checks the exit code."""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("disnake")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stubs the secrets module and the network, then runs the launcher
+DRIVER = f"""
+import runpy, socket, sys, types
+
+def no_network(*args, **kwargs):
+    raise OSError("network access during a --no-connect startup")
+
+socket.socket.connect = no_network
+socket.getaddrinfo = no_network
+
+auth = types.ModuleType("auth")
+def no_credentials(name):
+    raise AttributeError(f"auth.{{name}} used during a --no-connect startup")
+auth.__getattr__ = no_credentials
+sys.modules["auth"] = auth
+
+sys.argv = ["launcher.py", *sys.argv[1:]]
+runpy.run_path({os.path.join(ROOT, "launcher.py")!r}, run_name="__main__")
+"""
+
+
+def run_launcher(tmp_path, *args):
+    os.makedirs(tmp_path / "logs")
+    shutil.copy(os.path.join(ROOT, "logchamp.json"), tmp_path)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable, "-c", DRIVER, "--profile-startup", "--no-connect", *args],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+
+def test_startup_within_budget(tmp_path):
+    # no --startup-budget, so this checks settings.STARTUP_BUDGET
+    result = run_launcher(tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    reports = list((tmp_path / "logs").glob("startup-*.txt"))
+    assert len(reports) == 1
+    assert "cogs.admin" in reports[0].read_text()
+
+
+def test_startup_over_budget_fails(tmp_path):
+    result = run_launcher(tmp_path, "--startup-budget", "0")
+    assert result.returncode == 1, result.stderr
+    assert "over the 0.0s budget" in result.stdout + result.stderr
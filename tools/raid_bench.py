@@ -0,0 +1,309 @@
+"""Load generator and benchmark for the raid cog (cogs/raid.py).
+
+Synthesizes a raid (lots of fresh accounts joining through a few invites and
+spamming mentions, invite links and near-duplicate text, mixed with regular
+members chatting) and drives the cog's handlers directly with fake disnake
+objects, reporting throughput, latency and memory per stage. Timing and memory
+come from separate runs of the same raid, since tracemalloc slows everything
+down several times over.
+
+    python -m tools.raid_bench --raiders 5000 --messages 20000
+"""
+
+import argparse
+import asyncio
+import datetime
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import cogs.raid as raid
+from utils.journal import Journal
+
+SAFE_ROLE = 1  # any role not in raid.ROLES marks a member as safe
+EVERYONE = raid.BIKINI_BOTTOM
+
+SPAM = [
+    "JOIN NOW discord.gg/{code} FREE NITRO",
+    "raid raid raid {n}",
+    "get rekt lol {n}",
+    "https://discord.com/invite/{code} best server",
+]
+CHAT = ["hi", "anyone up?", "lol", "what's for dinner", "gg", "nice"]
+
+
+class FakeRole:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeUser:
+    def __init__(self, id, created_at, joined_at=None, roles=(), guild=None):
+        self.id = id
+        self.bot = False
+        self.created_at = created_at
+        self.joined_at = joined_at
+        self.roles = [FakeRole(role_id) for role_id in roles]
+        self.guild = guild
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return f"user{self.id}"
+
+
+class FakeChannel:
+    def __init__(self, id):
+        self.id = id
+
+    def __str__(self):
+        return f"channel{self.id}"
+
+
+class FakeInvite:
+    def __init__(self, code, inviter, created_at):
+        self.code = code
+        self.inviter = inviter
+        self.created_at = created_at
+        self.uses = 0
+        self.max_age = 0
+
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+        self._invites = []
+
+    async def invites(self):
+        return list(self._invites)
+
+
+class FakeMessage:
+    def __init__(self, id, guild, channel, author, content, mentions, created_at):
+        self.id = id
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.mentions = mentions
+        self.created_at = created_at
+
+
+class FakeBot:
+    def __init__(self, guild):
+        self.guild = guild
+
+    def get_guild(self, id):
+        return self.guild if id == self.guild.id else None
+
+
+class FakeContext:
+    def __init__(self, guild, channel, author):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.elapsed = 0.0
+        self.peak_memory = 0
+
+    def report(self):
+        n = len(self.latencies)
+        lat = sorted(self.latencies)
+        p95 = lat[int(n * 0.95) - 1] if n >= 20 else lat[-1]
+        return (
+            f"{self.name:<22} {n:>7} calls {n / self.elapsed:>11.0f}/s "
+            f"p50 {statistics.median(lat) * 1e6:>9.1f}us "
+            f"p95 {p95 * 1e6:>9.1f}us max {lat[-1] * 1e6:>10.1f}us "
+            f"peak {self.peak_memory / 1024 / 1024:>7.1f}MiB"
+        )
+
+
+async def measure(name, calls, trace_memory=False):
+    """Awaits each coroutine factory in calls, timing each one. With trace_memory,
+    records the peak of memory allocated during the stage instead; the timings
+    of that run are meaningless."""
+    stage = Stage(name)
+    if trace_memory:
+        # also resets the peak, unlike tracemalloc.reset_peak this works on 3.8
+        tracemalloc.clear_traces()
+    start = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        await call()
+        stage.latencies.append(time.perf_counter() - t)
+    stage.elapsed = time.perf_counter() - start
+    if trace_memory:
+        stage.peak_memory = tracemalloc.get_traced_memory()[1]
+    return stage
+
+
+def build_raid(args, rng, guild, now):
+    """Returns (members joining in order, messages in order, invites)."""
+    next_id = iter(range(10**17, 10**18)).__next__
+    inviter = FakeUser(next_id(), now - datetime.timedelta(days=900), guild=guild)
+    invites = [
+        FakeInvite(
+            f"raid{i}", inviter, now - datetime.timedelta(minutes=rng.randint(5, 50))
+        )
+        for i in range(args.invites)
+    ]
+    invites.append(FakeInvite("welcome", inviter, now - datetime.timedelta(days=400)))
+    guild._invites = invites
+
+    regulars = [
+        FakeUser(
+            next_id(),
+            now - datetime.timedelta(days=rng.randint(30, 2000)),
+            now - datetime.timedelta(days=rng.randint(1, 30)),
+            roles=(EVERYONE, SAFE_ROLE),
+            guild=guild,
+        )
+        for _ in range(args.regulars)
+    ]
+    # raid spread over the last hour, so cache cleaning has something to drop
+    raiders = []
+    for i in range(args.raiders):
+        joined_at = now - datetime.timedelta(seconds=3600 * (1 - i / args.raiders))
+        raiders.append(
+            FakeUser(
+                next_id(),
+                joined_at - datetime.timedelta(minutes=rng.randint(1, 120)),
+                joined_at,
+                roles=(EVERYONE,),
+                guild=guild,
+            )
+        )
+
+    channels = [FakeChannel(next_id()) for _ in range(args.channels)]
+    messages = []
+    for i in range(args.messages):
+        created_at = now - datetime.timedelta(seconds=3600 * (1 - i / args.messages))
+        channel = rng.choice(channels)
+        if rng.random() < args.spam_ratio:
+            author = rng.choice(raiders)
+            content = rng.choice(SPAM).format(code=rng.choice(invites).code, n=i)
+            mentions = rng.sample(regulars, min(len(regulars), rng.randint(0, 20)))
+        else:
+            author = rng.choice(regulars)
+            content = rng.choice(CHAT)
+            mentions = []
+        messages.append(
+            FakeMessage(
+                next_id(), guild, channel, author, content, mentions, created_at
+            )
+        )
+    return raiders, messages, invites, channels
+
+
+async def run_pass(args, trace_memory):
+    """Runs the whole raid through a fresh cog, returns (stages, ctx, cog, counts)."""
+    rng = random.Random(args.seed)
+    raid.INVITE_UPDATE_DELAY = 0
+    now = datetime.datetime.now(datetime.timezone.utc)
+    guild = FakeGuild(raid.BIKINI_BOTTOM)
+    raiders, messages, invites, channels = build_raid(args, rng, guild, now)
+    raid_invites = invites[:-1]
+
+    if trace_memory:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as journal_dir:
+        cog = raid.WARNING_EXPERIMENTAL(FakeBot(guild))
+        cog.clean_raid_cache_task.cancel()
+        cog.journal.stop()
+        cog.journal = Journal("raid", directory=journal_dir)
+        cog.journal.start()
+        await cog.on_ready()
+
+        def join(member):
+            async def call():
+                rng.choice(raid_invites).uses += 1
+                await cog.on_member_join(member)
+
+            return call
+
+        def message(msg):
+            return lambda: cog.on_message(msg)
+
+        ctx = FakeContext(guild, channels[0], raiders[0])
+        cleanup_args = dict(
+            ctx=ctx,
+            channel=None,
+            mention_count_threshold=10,
+            msg_contains_invite=True,
+            msg_content="raid",
+        )
+        age = datetime.timedelta(minutes=raid.CACHE_REMOVE_AGE_THRESHOLD)
+
+        stages = [
+            await measure("on_member_join", [join(m) for m in raiders], trace_memory),
+            await measure("on_message", [message(m) for m in messages], trace_memory),
+            await measure(
+                "raid_check_invites",
+                [lambda: cog.raid_check_invites.callback(cog, ctx)] * args.repeat,
+                trace_memory,
+            ),
+            await measure(
+                "execute_raid_cleanup",
+                [lambda: cog.execute_raid_cleanup(**cleanup_args)] * args.repeat,
+                trace_memory,
+            ),
+            await measure(
+                "clean_raid_cache", [lambda: cog.clean_raid_cache(age)], trace_memory
+            ),
+        ]
+        cog.journal.stop()
+    if trace_memory:
+        tracemalloc.stop()
+    counts = (len(raiders), len(messages), len(raid_invites), len(channels))
+    return stages, ctx, cog, counts
+
+
+async def run(args):
+    stages, ctx, cog, counts = await run_pass(args, trace_memory=False)
+    memory_stages, _, _, _ = await run_pass(args, trace_memory=True)
+    for stage, memory_stage in zip(stages, memory_stages):
+        stage.peak_memory = memory_stage.peak_memory
+
+    raiders, messages, raid_invites, channels = counts
+    print(
+        f"{raiders} raiders, {args.regulars} regulars, {messages} messages, "
+        f"{raid_invites} raid invites, {channels} channels"
+    )
+    for stage in stages:
+        print(stage.report())
+    flagged = next((c for c in ctx.sent if c and c.startswith("Flagged")), None)
+    print(f"cleanup result: {flagged}")
+    print(
+        f"cache after cleaning: {len(cog.cached_messages)} messages, "
+        f"{len(cog.cached_joins)} joins, {len(cog.cached_invites)} invites"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raid cog")
+    parser.add_argument("--raiders", type=int, default=2000)
+    parser.add_argument("--regulars", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--invites", type=int, default=3)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--spam-ratio", type=float, default=0.7)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
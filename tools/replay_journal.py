@@ -0,0 +1,67 @@
+"""Runs the raid cleanup analysis against raid journal files, offline.
+
+python -m tools.replay_journal data/journal/raid-*.jsonl --mentions 10 --invite
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+
+from cogs.raid import TimeDelta, flag_messages
+from utils.journal import ReplayChannel, read_journal, replay
+
+logger = logging.getLogger("tools.replay_journal")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay raid journal files offline")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--channel", type=int, help="only check this channel id")
+    parser.add_argument("--time", type=TimeDelta().convert_to_time)
+    parser.add_argument("--join-time", type=TimeDelta().convert_to_time)
+    parser.add_argument("--content")
+    parser.add_argument("--mentions", type=int)
+    parser.add_argument("--invite", action="store_true")
+    parser.add_argument("--debug", "-d", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    records = list(read_journal(args.paths))
+    if not records:
+        print("No records found.")
+        return
+    messages, joins, invites = replay(records)
+    # analyse as of the end of the journal rather than now
+    now = datetime.datetime.fromtimestamp(records[-1]["t"], tz=datetime.timezone.utc)
+
+    channel = ReplayChannel(args.channel) if args.channel else None
+
+    flagged_members, flagged_messages = flag_messages(
+        messages,
+        channel=channel,
+        now=now,
+        approx_msg_time=args.time,
+        approx_join_time=args.join_time,
+        msg_content=args.content.lower() if args.content else None,
+        mention_count_threshold=args.mentions,
+        msg_contains_invite=args.invite,
+    )
+
+    print(
+        f"{len(records)} records: {len(messages)} messages, {len(joins)} joins, "
+        f"{sum(map(len, invites.values()))} invite uses, ending {now}"
+    )
+    for code, timestamps in sorted(invites.items(), key=lambda t: -len(t[1])):
+        print(f"  invite {code}: {len(timestamps)} uses")
+    per_channel = collections.Counter(m.channel.id for m in flagged_messages)
+    print(f"Flagged {len(flagged_messages)} messages from {len(flagged_members)} users")
+    for channel_id, count in per_channel.most_common():
+        print(f"  channel {channel_id}: {count} messages")
+    for user_id in sorted(flagged_members):
+        print(user_id)
+
+
+if __name__ == "__main__":
+    main()
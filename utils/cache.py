@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("utils.cache")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry when full.
+    If ttl (seconds) is given, entries also expire that long after being set.
+    Keeps hit/miss counters so callers can report how well it's doing."""
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def dump(self):
+        """Returns live entries as (key, value, expires_at) tuples, oldest first."""
+        now = time.time()
+        return [
+            (key, value, expires_at)
+            for key, (value, expires_at) in self._data.items()
+            if expires_at is None or expires_at > now
+        ]
+
+    def load(self, entries):
+        """Restores entries produced by dump(), skipping any that have expired."""
+        now = time.time()
+        for key, value, expires_at in entries:
+            if expires_at is None or expires_at > now:
+                self.set(key, value, expires_at)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return (
+            f"{len(self._data)}/{self.maxsize} entries, "
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)"
+        )
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single in-flight call.
+    Callers that arrive while the call is running await the same result."""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield so one caller being cancelled doesn't cancel the others
+        return await asyncio.shield(task)
+
+
+def _store(path, data):
+    """Writes data to path through a temporary file, returns its size. Blocking."""
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return len(data)
+
+
+class DiskCache:
+    """Files in a directory, named by the sha256 of their key. Once the files add
+    up to more than max_bytes, the least recently used ones are deleted.
+    Recency survives restarts through file modification times."""
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._sizes = OrderedDict()  # file name -> size, least recently used first
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def size(self):
+        return sum(self._sizes.values())
+
+    def _name(self, key):
+        return hashlib.sha256(key.encode()).hexdigest() + self.suffix
+
+    def get(self, key):
+        """Returns the path of the file for key, or None if it isn't cached."""
+        name = self._name(key)
+        if name not in self._sizes:
+            self.misses += 1
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            del self._sizes[name]
+            self.misses += 1
+            return None
+        self._sizes.move_to_end(name)
+        self.hits += 1
+        return path
+
+    async def fill(self, key, write):
+        """Creates the file for key from what write(fp) writes to an in-memory
+        binary buffer. The file is only written if write succeeds, and the disk
+        work runs in the default executor. Returns the path."""
+        buffer = io.BytesIO()
+        await write(buffer)
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        loop = asyncio.get_running_loop()
+        size = await loop.run_in_executor(None, _store, path, buffer.getbuffer())
+        self._sizes[name] = size
+        self._sizes.move_to_end(name)
+        self._evict()
+        return path
+
+    def _evict(self):
+        total = self.size
+        # never evict the file that was just added
+        while total > self.max_bytes and len(self._sizes) > 1:
+            name, size = self._sizes.popitem(last=False)
+            total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"{len(self._sizes)} files, {self.size / 1024 / 1024:.1f}/"
+            f"{self.max_bytes / 1024 / 1024:.0f}MiB, {self.hits} hits, "
+            f"{self.misses} misses ({hit_rate:.1%} hit rate)"
+        )
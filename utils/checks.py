@@ -6,6 +6,8 @@ from utils.settings import ADMINS, MODS
 
 logger = logging.getLogger("utils.checks")
 
+MOD_ROLE = 736363032304943135
+
 
 def _has_role(user, roleid):
     for role in user.roles:
@@ -19,7 +21,41 @@ def is_admin(user):
 
 
 def is_mod(user):
-    return is_admin(user) or _has_role(user, 736363032304943135)
+    return is_admin(user) or _has_role(user, MOD_ROLE)
+
+
+class ModeratorCache:
+    """Ids of every user that passes is_mod, so messages from everyone else can be
+    dropped before a Context is built. Until built, everyone might be a mod."""
+
+    def __init__(self):
+        self.ready = False
+        self.ids = set(ADMINS)
+
+    def build(self, guilds):
+        ids = set(ADMINS)
+        for guild in guilds:
+            role = guild.get_role(MOD_ROLE)
+            if role:
+                ids.update(member.id for member in role.members)
+        self.ids = ids
+        self.ready = True
+
+    def update(self, member):
+        # only the guild that owns the mod role can change who's a mod
+        if member.guild.get_role(MOD_ROLE) is None:
+            return
+        if is_mod(member):
+            self.ids.add(member.id)
+        elif member.id not in ADMINS:
+            self.ids.discard(member.id)
+
+    def remove(self, member):
+        if member.guild.get_role(MOD_ROLE) is not None and member.id not in ADMINS:
+            self.ids.discard(member.id)
+
+    def might_be_mod(self, user_id):
+        return not self.ready or user_id in self.ids
 
 
 def hall_monitor():
@@ -15,13 +15,14 @@ class FetchedUser(commands.Converter):
         if not argument.isdigit():
             raise commands.BadArgument("Not a valid user ID.")
         try:
-            return await ctx.bot.fetch_user(argument)
-        except disnake.NotFound:
-            raise commands.BadArgument("User not found.") from None
+            result = await ctx.bot.resolver.user(int(argument))
         except disnake.HTTPException:
             raise commands.BadArgument(
                 "An error occurred while fetching the user."
             ) from None
+        if result is None:
+            raise commands.BadArgument("User not found.")
+        return result
 
 
 class FetchedChannel(commands.Converter):
@@ -29,13 +30,14 @@ class FetchedChannel(commands.Converter):
         if not argument.isdigit():
             raise commands.BadArgument("Not a valid channel ID.")
         try:
-            return await ctx.bot.fetch_channel(argument)
-        except disnake.NotFound:
-            raise commands.BadArgument("Channel not found.") from None
+            result = await ctx.bot.resolver.channel(int(argument))
         except disnake.HTTPException:
             raise commands.BadArgument(
                 "An error occurred while fetching the channel."
             ) from None
+        if result is None:
+            raise commands.BadArgument("Channel not found.")
+        return result
 
 
 class FetchedGuild(commands.Converter):
@@ -43,13 +45,14 @@ class FetchedGuild(commands.Converter):
         if not argument.isdigit():
             raise commands.BadArgument("Not a valid guild ID.")
         try:
-            return await ctx.bot.fetch_guild(argument)
-        except disnake.NotFound:
-            raise commands.BadArgument("Guild not found.") from None
+            result = await ctx.bot.resolver.guild(int(argument))
         except disnake.HTTPException:
             raise commands.BadArgument(
                 "An error occurred while fetching the guild."
             ) from None
+        if result is None:
+            raise commands.BadArgument("Guild not found.")
+        return result
 
 
 class CachedGuild(commands.Converter):
@@ -94,33 +97,6 @@ class OptionFlag(commands.Converter):
         return argument[2:]
 
 
-class Language(commands.Converter):
-    async def convert(self, ctx, argument):
-        argument = argument.lower()
-
-        def update_langs():
-            langs = ctx.cog.translator.get_languages(target_language="en")
-            for lang in langs:
-                ctx.cog.lang_cache[lang["name"].lower()] = lang["language"]
-
-        def get_lang():
-            if argument in ctx.cog.lang_cache.keys():
-                return ctx.cog.lang_cache[argument]
-            elif argument in ctx.cog.lang_cache.values():
-                return argument
-
-        result = get_lang()
-        if result:
-            return result
-
-        update_langs()
-        result = get_lang()
-        if result:
-            return result
-
-        raise commands.BadArgument("Could not convert to a supported language.")
-
-
 class Command(commands.Converter):
     async def convert(self, ctx, argument):
         command = ctx.bot.get_command(argument)
@@ -0,0 +1,104 @@
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger("utils.http")
+
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300  # seconds
+KEEPALIVE_TIMEOUT = 60  # seconds
+TIMEOUT = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=30)
+MAX_RESPONSE_SIZE = 8 * 1024 * 1024  # bytes, default limit for read/text/download
+CHUNK_SIZE = 64 * 1024
+
+
+def redact_url(url):
+    """The url without its query string and fragment, which can hold api keys.
+    Exceptions raised here only ever mention urls redacted like this."""
+    parts = urlsplit(str(url))
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+class ResponseTooLarge(Exception):
+    def __init__(self, url, limit):
+        self.url = url
+        self.limit = limit
+        super().__init__(
+            f"Response from {redact_url(url)} is larger than {limit} bytes."
+        )
+
+
+class HTTPStatusError(aiohttp.ClientError):
+    """Raised for error statuses instead of aiohttp.ClientResponseError, whose
+    message includes the full request url."""
+
+    def __init__(self, url, status, reason):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        super().__init__(f"{status} {reason} from {redact_url(url)}")
+
+
+class HTTPSession:
+    """The bot's one HTTP client. Wraps a single aiohttp session with a pooled,
+    keep-alive connector so bursts of requests reuse connections, and adds
+    size-limited helpers for reading and streaming response bodies.
+    Has to be created from a running event loop."""
+
+    def __init__(self):
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=TIMEOUT)
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    def get(self, url, **kwargs):
+        """Same as aiohttp.ClientSession.get, for callers that want the response."""
+        return self.session.get(url, **kwargs)
+
+    async def stream(
+        self, url, max_size=MAX_RESPONSE_SIZE, chunk_size=CHUNK_SIZE, timeout=None
+    ):
+        """Yields the body of a GET request in chunks. Raises ResponseTooLarge once
+        more than max_size bytes have arrived (or are announced), and
+        HTTPStatusError for error statuses. timeout (an aiohttp.ClientTimeout)
+        replaces the session's TIMEOUT, whose total also covers the time the
+        caller spends between chunks."""
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        async with self.session.get(url, **kwargs) as resp:
+            if resp.status >= 400:
+                raise HTTPStatusError(url, resp.status, resp.reason)
+            if max_size and resp.content_length and resp.content_length > max_size:
+                raise ResponseTooLarge(url, max_size)
+            received = 0
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                received += len(chunk)
+                if max_size and received > max_size:
+                    raise ResponseTooLarge(url, max_size)
+                yield chunk
+
+    async def read(self, url, max_size=MAX_RESPONSE_SIZE):
+        chunks = [chunk async for chunk in self.stream(url, max_size)]
+        return b"".join(chunks)
+
+    async def text(self, url, max_size=MAX_RESPONSE_SIZE, encoding="utf-8"):
+        return (await self.read(url, max_size)).decode(encoding, errors="replace")
+
+    async def download(self, url, fp, max_size=MAX_RESPONSE_SIZE):
+        """Streams the body into a binary file object. Returns the number of bytes."""
+        size = 0
+        async for chunk in self.stream(url, max_size):
+            fp.write(chunk)
+            size += len(chunk)
+        return size
@@ -0,0 +1,263 @@
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger("utils.journal")
+
+JOURNAL_DIR = "data/journal"
+MAX_BYTES = 50 * 1024 * 1024  # start a new journal file at this size
+MAX_FILES = 20  # journal files kept per name, older ones are deleted
+MAX_AGE = 14 * 24 * 60 * 60  # seconds, older journal files are deleted
+FLUSH_INTERVAL = 1.0  # seconds
+FLUSH_SIZE = 256  # records
+
+
+class Journal:
+    """Append-only JSONL journal. write() only enqueues the record, a background
+    thread buffers records and appends them to the current file, starting a new
+    file once it reaches max_bytes. Whenever a file is started, old files beyond
+    max_files or last written more than max_age seconds ago are deleted."""
+
+    def __init__(
+        self,
+        name,
+        directory=JOURNAL_DIR,
+        max_bytes=MAX_BYTES,
+        max_files=MAX_FILES,
+        max_age=MAX_AGE,
+    ):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age = max_age
+        self.path = None
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._fp = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name=f"journal-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Writes out everything queued so far and stops the writer thread."""
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def write(self, type_, **fields):
+        self._queue.put({"t": time.time(), "type": type_, **fields})
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(self.directory, f"{self.name}-{stamp}.jsonl")
+        self._fp = open(self.path, "a", encoding="utf-8")
+        self._prune()
+
+    def _prune(self):
+        """Deletes this journal's old files, never the current one."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if (
+                entry.is_file()
+                and entry.name.startswith(f"{self.name}-")
+                and entry.name.endswith(".jsonl")
+                and entry.path != self.path
+            ):
+                files.append((entry.stat().st_mtime, entry.path))
+        files.sort(reverse=True)
+        cutoff = time.time() - self.max_age
+        for i, (mtime, path) in enumerate(files):
+            # the current file counts towards max_files
+            if i + 1 >= self.max_files or mtime < cutoff:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not delete old journal {path}: {e}")
+
+    def _flush(self, lines):
+        try:
+            if self._fp is None or self._fp.tell() >= self.max_bytes:
+                if self._fp:
+                    self._fp.close()
+                self._open()
+            self._fp.write("".join(lines))
+            self._fp.flush()
+        except OSError as e:
+            logger.error(f"Failed to write {len(lines)} journal records: {e}")
+
+    def _run(self):
+        lines = []
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                record = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                record = {}
+            if record is None:
+                running = False
+            elif record:
+                lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+            now = time.monotonic()
+            if lines and (
+                not running
+                or len(lines) >= FLUSH_SIZE
+                or now - last_flush >= FLUSH_INTERVAL
+            ):
+                self._flush(lines)
+                lines = []
+                last_flush = now
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+
+def _timestamp(dt):
+    return dt.timestamp() if dt else None
+
+
+def member_record(member):
+    return {
+        "id": member.id,
+        "name": str(member),
+        "bot": member.bot,
+        "roles": [role.id for role in getattr(member, "roles", ())],
+        "joined_at": _timestamp(getattr(member, "joined_at", None)),
+        "created_at": _timestamp(member.created_at),
+    }
+
+
+def message_record(message):
+    return {
+        "id": message.id,
+        "guild_id": message.guild.id if message.guild else None,
+        "channel_id": message.channel.id,
+        "author": member_record(message.author),
+        "content": message.content,
+        "mentions": [user.id for user in message.mentions],
+        "created_at": _timestamp(message.created_at),
+    }
+
+
+def read_journal(paths):
+    """Yields records from journal files, in the order given."""
+    for path in paths:
+        with open(path, encoding="utf-8") as fp:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a crash can leave a partial last line
+                    logger.warning(f"Skipping malformed journal line in {path}")
+
+
+# Lightweight stand-ins for the disnake objects the raid code looks at, rebuilt
+# from journal records so it can run without a gateway connection.
+
+
+def _datetime(ts):
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+
+
+class ReplayObject:
+    def __init__(self, id):
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, ReplayObject) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.id}>"
+
+
+class ReplayGuild(ReplayObject):
+    pass
+
+
+class ReplayChannel(ReplayObject):
+    def __str__(self):
+        return str(self.id)
+
+
+class ReplayRole(ReplayObject):
+    pass
+
+
+class ReplayMember(ReplayObject):
+    def __init__(self, record, guild=None):
+        super().__init__(record["id"])
+        self.name = record.get("name")
+        self.bot = record.get("bot", False)
+        self.roles = [ReplayRole(role_id) for role_id in record.get("roles", ())]
+        self.joined_at = _datetime(record.get("joined_at"))
+        self.created_at = _datetime(record.get("created_at"))
+        self.guild = guild
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name or str(self.id)
+
+
+class ReplayMessage(ReplayObject):
+    def __init__(self, record, channels=None, guilds=None):
+        super().__init__(record["id"])
+        guild_id = record.get("guild_id")
+        self.guild = (guilds or {}).get(guild_id) or ReplayGuild(guild_id)
+        channel_id = record["channel_id"]
+        self.channel = (channels or {}).get(channel_id) or ReplayChannel(channel_id)
+        self.author = ReplayMember(record["author"], self.guild)
+        self.content = record.get("content", "")
+        self.mentions = [ReplayObject(user_id) for user_id in record["mentions"]]
+        self.created_at = _datetime(record.get("created_at"))
+
+
+def replay(records):
+    """Rebuilds raid cache contents from journal records.
+    Returns (messages, joins, invites), shaped like the raid cog's caches."""
+    channels = {}
+    guilds = {}
+    messages = []
+    joins = []
+    invites = {}  # invite code -> [use timestamps]
+    for record in records:
+        type_ = record.get("type")
+        if type_ == "message":
+            channels.setdefault(
+                record["channel_id"], ReplayChannel(record["channel_id"])
+            )
+            guilds.setdefault(record["guild_id"], ReplayGuild(record["guild_id"]))
+            messages.append(ReplayMessage(record, channels, guilds))
+        elif type_ == "join":
+            guild = guilds.setdefault(
+                record["guild_id"], ReplayGuild(record["guild_id"])
+            )
+            joins.append(ReplayMember(record["member"], guild))
+        elif type_ == "invites":
+            when = _datetime(record["t"])
+            for code, uses in record["deltas"].items():
+                invites.setdefault(code, []).extend([when] * uses)
+    return messages, joins, invites
@@ -0,0 +1,173 @@
+import logging
+import time
+from bisect import bisect_left, insort
+
+import numpy as np
+
+logger = logging.getLogger("utils.members")
+
+ROLE_WORDS = 4  # 256 role bits per member, guilds are capped at 250 roles
+DAY = 24 * 60 * 60
+
+
+class JoinIndex:
+    """Members of a guild kept sorted by join time, so join positions and
+    "who joined Nth" are a binary search instead of a sort of the whole guild."""
+
+    def __init__(self, members=()):
+        self._keys = {}  # member id -> (joined_at timestamp, member id)
+        order = []
+        for member in members:
+            key = self._key(member)
+            if key:
+                self._keys[member.id] = key
+                order.append(key)
+        order.sort()
+        self._order = order
+
+    def __len__(self):
+        return len(self._order)
+
+    @staticmethod
+    def _key(member):
+        if member.joined_at is None:
+            return None
+        return member.joined_at.timestamp(), member.id
+
+    def add(self, member):
+        key = self._key(member)
+        if not key or member.id in self._keys:
+            return
+        self._keys[member.id] = key
+        insort(self._order, key)
+
+    def remove(self, member_id):
+        key = self._keys.pop(member_id, None)
+        if key is None:
+            return
+        i = bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    def position(self, member_id):
+        """1-indexed join position of a member, or None if they aren't indexed."""
+        key = self._keys.get(member_id)
+        if key is None:
+            return None
+        return bisect_left(self._order, key) + 1
+
+    def member_at(self, position):
+        """Id of the member at a 1-indexed join position, or None if out of range."""
+        if not 1 <= position <= len(self._order):
+            return None
+        return self._order[position - 1][1]
+
+
+class MemberSnapshot:
+    """Columnar copy of a guild's members (ids, join and creation timestamps, role
+    bitmasks) in NumPy arrays, kept up to date from member events, so guild stats
+    are vectorized queries instead of loops over guild.members."""
+
+    def __init__(self, members=(), capacity=1024):
+        capacity = max(capacity, len(members))
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.uint64)
+        self.joined_at = np.full(capacity, np.nan)
+        self.created_at = np.zeros(capacity)
+        self.roles = np.zeros((capacity, ROLE_WORDS), dtype=np.uint64)
+        self._rows = {}  # member id -> row
+        self._role_bits = {}  # role id -> bit
+        self._free_bits = list(range(ROLE_WORDS * 64 - 1, -1, -1))
+        for member in members:
+            self.add(member)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        self.ids = np.resize(self.ids, capacity)
+        self.joined_at = np.resize(self.joined_at, capacity)
+        self.created_at = np.resize(self.created_at, capacity)
+        roles = np.zeros((capacity, ROLE_WORDS), dtype=np.uint64)
+        roles[: self.size] = self.roles[: self.size]
+        self.roles = roles
+
+    def _role_mask(self, member):
+        mask = [0] * ROLE_WORDS
+        for role in member.roles:
+            bit = self._role_bits.get(role.id)
+            if bit is None:
+                if not self._free_bits:
+                    logger.warning(f"No free role bit for role {role.id}")
+                    continue
+                bit = self._role_bits[role.id] = self._free_bits.pop()
+            mask[bit // 64] |= 1 << (bit % 64)
+        return mask
+
+    def add(self, member):
+        row = self._rows.get(member.id)
+        if row is None:
+            if self.size == len(self.ids):
+                self._grow()
+            row = self._rows[member.id] = self.size
+            self.size += 1
+        self.ids[row] = member.id
+        self.joined_at[row] = (
+            member.joined_at.timestamp() if member.joined_at else np.nan
+        )
+        self.created_at[row] = member.created_at.timestamp()
+        self.roles[row] = self._role_mask(member)
+
+    update = add
+
+    def remove(self, member_id):
+        row = self._rows.pop(member_id, None)
+        if row is None:
+            return
+        # move the last row into the gap to keep the arrays dense
+        last = self.size - 1
+        if row != last:
+            self.ids[row] = self.ids[last]
+            self.joined_at[row] = self.joined_at[last]
+            self.created_at[row] = self.created_at[last]
+            self.roles[row] = self.roles[last]
+            self._rows[int(self.ids[row])] = row
+        self.size = last
+
+    def remove_role(self, role_id):
+        bit = self._role_bits.pop(role_id, None)
+        if bit is None:
+            return
+        word, offset = divmod(bit, 64)
+        self.roles[: self.size, word] &= ~np.uint64(1 << offset)
+        self._free_bits.append(bit)
+
+    def joins_per_day(self, days, now=None):
+        """Joins in each of the last `days` days, oldest first."""
+        now = now or time.time()
+        start = now - days * DAY
+        joined = self.joined_at[: self.size]
+        recent = joined[joined >= start]
+        day = ((recent - start) // DAY).astype(np.int64)
+        return np.bincount(np.minimum(day, days - 1), minlength=days)
+
+    def account_ages(self, joined_within, bins, now=None):
+        """Histogram of account age (in days, at join time) of members who joined
+        within the last `joined_within` days, using the given bin edges."""
+        now = now or time.time()
+        joined = self.joined_at[: self.size]
+        recent = joined >= now - joined_within * DAY
+        ages = (joined[recent] - self.created_at[: self.size][recent]) / DAY
+        counts, _ = np.histogram(ages, bins=bins)
+        return counts
+
+    def role_counts(self):
+        """Maps role id -> number of members with that role."""
+        roles = self.roles[: self.size]
+        counts = {}
+        for role_id, bit in self._role_bits.items():
+            word, offset = divmod(bit, 64)
+            has_role = (roles[:, word] >> np.uint64(offset)) & np.uint64(1)
+            counts[role_id] = int(has_role.sum())
+        return counts
@@ -0,0 +1,137 @@
+import logging
+import math
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger("utils.metrics")
+
+# latency bucket upper bounds, in seconds
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    math.inf,
+)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to update on every event."""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q-th quantile."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Latency histograms for event listeners and commands, event loop lag and
+    plain counters. Rendered for humans by summary() and for Prometheus by render()."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.events = {}  # (event name, listener) -> Histogram
+        self.commands = {}  # qualified command name -> Histogram
+        self.loop_lag = Histogram()
+        self.counters = {}
+
+    def observe_event(self, event_name, listener, seconds):
+        key = (event_name, listener)
+        histogram = self.events.get(key)
+        if histogram is None:
+            histogram = self.events[key] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_command(self, name, seconds):
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self, top=10):
+        def fmt(name, h):
+            return (
+                f"{name}: n={h.count} mean={h.mean * 1000:.1f}ms "
+                f"p95={h.quantile(0.95) * 1000:.1f}ms max={h.max * 1000:.1f}ms"
+            )
+
+        lines = ["Event listeners (by total time):"]
+        events = sorted(self.events.items(), key=lambda t: -t[1].sum)
+        for (event, listener), h in events[:top]:
+            lines.append("  " + fmt(f"{event} [{listener}]", h))
+        lines.append("Commands (by total time):")
+        commands = sorted(self.commands.items(), key=lambda t: -t[1].sum)
+        for name, h in commands[:top]:
+            lines.append("  " + fmt(name, h))
+        lines.append(fmt("Event loop lag", self.loop_lag))
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+
+        def histogram(metric, labels, h):
+            seen = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                seen += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{metric}_bucket{{{labels}le="{le}"}} {seen}')
+            bare = labels.rstrip(",")
+            lines.append(f"{metric}_sum{{{bare}}} {h.sum}")
+            lines.append(f"{metric}_count{{{bare}}} {h.count}")
+
+        lines.append("# TYPE squire_event_seconds histogram")
+        for (event, listener), h in self.events.items():
+            histogram(
+                "squire_event_seconds", f'event="{event}",listener="{listener}",', h
+            )
+        lines.append("# TYPE squire_command_seconds histogram")
+        for name, h in self.commands.items():
+            histogram("squire_command_seconds", f'command="{name}",', h)
+        lines.append("# TYPE squire_loop_lag_seconds histogram")
+        histogram("squire_loop_lag_seconds", "", self.loop_lag)
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE squire_{name} counter")
+            lines.append(f"squire_{name} {value}")
+        lines.append(f"squire_start_time_seconds {self.started_at}")
+        return "\n".join(lines) + "\n"
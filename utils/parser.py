@@ -5,5 +5,18 @@ parser.add_argument("--debug", "-d", action="store_true")  # debug logger
 parser.add_argument(
     "--dev", action="store_true"
 )  # running from my pc - remote db connection
+parser.add_argument(
+    "--profile-startup", action="store_true"
+)  # time every import, cog load and time-to-ready, write a report to logs/
+parser.add_argument(
+    "--no-connect", action="store_true"
+)  # with --profile-startup: stop after loading cogs instead of logging in
+parser.add_argument(
+    "--startup-budget", type=float
+)  # seconds, overrides settings.STARTUP_BUDGET
+
+parser.add_argument(
+    "--cache-profile"
+)  # intents and cache profile from settings.PROFILES, overrides settings.CACHE_PROFILE
 
 ARGS = parser.parse_args()
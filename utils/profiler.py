@@ -0,0 +1,158 @@
+import asyncio
+import cProfile
+import collections
+import io
+import logging
+import marshal
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("utils.profiler")
+
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+MAX_STACK_DEPTH = 128
+TRACEMALLOC_FRAMES = 10
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stack of a thread (the event loop's by default) from a
+    background thread, counting collapsed stacks. The overhead is one stack walk
+    per interval, so it's fine to leave running on the live bot for a while."""
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """The samples in the collapsed stack format flamegraph.pl and speedscope
+        read: one "frame;frame;frame count" line per distinct stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def top(self, limit=15):
+        """The functions most often on top of the stack, as (name, samples)."""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rpartition(";")[2]] += count
+        return leaves.most_common(limit)
+
+    def summary(self, limit=15):
+        elapsed = (self.stopped or time.perf_counter()) - self.started
+        lines = [f"{self.samples} samples over {elapsed:.1f}s, self time:"]
+        for name, count in self.top(limit):
+            lines.append(f"{count / max(self.samples, 1):>6.1%}  {name}")
+        return "\n".join(lines)
+
+
+async def profile_window(seconds):
+    """Runs cProfile over everything the event loop does for a number of seconds."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+    return profile
+
+
+def profile_stats(profile, sort="cumulative", limit=25):
+    """Formats a cProfile.Profile the way pstats prints it."""
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def dump_stats(profile):
+    """Returns a cProfile.Profile as the bytes of a pstats dump file (for snakeviz,
+    python -m pstats, ...)."""
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+class MemoryTracker:
+    """Takes tracemalloc snapshots and diffs each one against the first, to find
+    what keeps growing."""
+
+    def __init__(self):
+        self.baseline = None
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=TRACEMALLOC_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = self._snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ]
+        )
+
+    def diff(self, key_type="lineno", limit=15):
+        """Top allocation growth since start, as text."""
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self.baseline, key_type)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Traced: {current / 1024 / 1024:.1f}MiB now, "
+            f"{peak / 1024 / 1024:.1f}MiB peak. Growth since start:"
+        ]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:>+10.1f}KiB {stat.count_diff:>+8} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,183 @@
+import asyncio
+import codecs
+import logging
+import re
+import time
+
+import disnake
+
+from utils.cache import LRUCache, SingleFlight
+
+logger = logging.getLogger("utils.resolver")
+
+CACHE_SIZE = 4096
+CACHE_TTL = 60 * 60  # seconds
+NOT_FOUND_TTL = 10 * 60  # seconds to remember that an id doesn't exist
+
+FETCH_CONCURRENCY = 10  # concurrent API fetches in resolve_many
+MAX_TOKEN_LENGTH = 64  # longer tokens in a stream can't be ids, they're cut off
+
+_NOT_FOUND = object()
+# a bare id or a user mention
+SNOWFLAKE_PATTERN = re.compile(r"(?:<@!?)?(\d{15,20})>?")
+
+
+def parse_snowflake(token):
+    """Returns the id in a token (an int, a bare id or a mention), or None."""
+    if isinstance(token, int):
+        return token
+    match = SNOWFLAKE_PATTERN.fullmatch(token.strip())
+    return int(match.group(1)) if match else None
+
+
+class BulkResolution:
+    """Result of Resolver.resolve_many."""
+
+    def __init__(self):
+        self.members = []  # cached members of the guild
+        self.users = []  # fetched users, if fetching
+        self.unresolved = []  # ids that weren't (or couldn't be) looked up
+        self.not_found = []  # ids the API doesn't know
+        self.invalid = []  # tokens that aren't ids
+        self.duplicates = []  # ids seen more than once
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.members) + len(self.users) + len(self.unresolved)
+
+    @property
+    def targets(self):
+        """Everything that resolved to an id, as objects moderation calls accept."""
+        return (
+            self.members
+            + self.users
+            + [disnake.Object(user_id) for user_id in self.unresolved]
+        )
+
+    def add(self, token, guild=None):
+        """Sorts one token into the result. Returns what it resolved to (a member or
+        a disnake.Object), or None for invalid tokens and duplicates."""
+        user_id = parse_snowflake(token)
+        if user_id is None:
+            self.invalid.append(token)
+            return None
+        if user_id in self._seen:
+            self.duplicates.append(user_id)
+            return None
+        self._seen.add(user_id)
+        member = guild.get_member(user_id) if guild else None
+        if member is not None:
+            self.members.append(member)
+            return member
+        self.unresolved.append(user_id)
+        return disnake.Object(user_id)
+
+    def summary(self):
+        return (
+            f"{len(self)} users ({len(self.members)} members, "
+            f"{len(self.users) + len(self.unresolved)} others), "
+            f"{len(self.invalid)} invalid, {len(self.duplicates)} duplicates, "
+            f"{len(self.not_found)} not found"
+        )
+
+
+class Resolver:
+    """Resolves users, channels and guilds by id. Checks the gateway cache first,
+    then a TTL cache of objects fetched before (including ids that turned out not to
+    exist), and only then the API. Concurrent lookups of the same id share a request.
+    Returns None for ids that don't exist, HTTPExceptions propagate."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.cache = LRUCache(CACHE_SIZE, ttl=CACHE_TTL)
+        self._single_flight = SingleFlight()
+
+    async def user(self, user_id):
+        return await self._resolve(
+            "user", user_id, self.bot.get_user, self.bot.fetch_user
+        )
+
+    async def channel(self, channel_id):
+        return await self._resolve(
+            "channel", channel_id, self.bot.get_channel, self.bot.fetch_channel
+        )
+
+    async def guild(self, guild_id):
+        return await self._resolve(
+            "guild", guild_id, self.bot.get_guild, self.bot.fetch_guild
+        )
+
+    async def _resolve(self, kind, id, get, fetch):
+        obj = get(id)
+        if obj is not None:
+            return obj
+        key = (kind, id)
+        obj = self.cache.get(key)
+        if obj is _NOT_FOUND:
+            return None
+        if obj is not None:
+            return obj
+        return await self._single_flight.do(key, self._fetch, key, fetch, id)
+
+    async def _fetch(self, key, fetch, id):
+        try:
+            obj = await fetch(id)
+        except disnake.NotFound:
+            self.cache.set(key, _NOT_FOUND, expires_at=time.time() + NOT_FOUND_TTL)
+            return None
+        self.cache.set(key, obj)
+        return obj
+
+    async def resolve_many(self, guild, tokens, fetch=False):
+        """Resolves a big list of ids (or mentions) in one pass: drops duplicates and
+        invalid tokens, and picks out ids that are cached members of the guild.
+        With fetch, other ids are fetched as users, FETCH_CONCURRENCY at a time,
+        otherwise they're left unresolved, which is enough for e.g. bans."""
+        result = BulkResolution()
+        for token in tokens:
+            result.add(token, guild)
+
+        if fetch and result.unresolved:
+            semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+            async def fetch_one(user_id):
+                async with semaphore:
+                    try:
+                        return user_id, await self.user(user_id)
+                    except disnake.HTTPException as e:
+                        return user_id, e
+
+            unresolved = []
+            for user_id, user in await asyncio.gather(
+                *(fetch_one(user_id) for user_id in result.unresolved)
+            ):
+                if user is None:
+                    result.not_found.append(user_id)
+                elif isinstance(user, disnake.HTTPException):
+                    unresolved.append(user_id)
+                else:
+                    result.users.append(user)
+            result.unresolved = unresolved
+
+        return result
+
+
+async def iter_tokens(chunks, encoding="utf-8"):
+    """Splits an async iterable of byte chunks (e.g. HTTPSession.stream) into
+    whitespace or comma separated tokens as they arrive, without holding the whole
+    body. Tokens longer than MAX_TOKEN_LENGTH are cut off."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        text = pending + decoder.decode(chunk).replace(",", " ")
+        tokens = text.split()
+        # the last token may continue in the next chunk
+        if tokens and not text[-1].isspace():
+            pending = tokens.pop()[: MAX_TOKEN_LENGTH + 1]
+        else:
+            pending = ""
+        for token in tokens:
+            yield token[: MAX_TOKEN_LENGTH + 1]
+    pending += decoder.decode(b"", final=True).replace(",", " ")
+    for token in pending.split():
+        yield token
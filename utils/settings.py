@@ -10,10 +10,45 @@ COGS = [
     # "cogs.raid",
     "cogs.rdanny",
     "cogs.devtools",
+    "cogs.monitor",
     # "cogs.timeout",
-    # 'cogs.logchamp',
+    "cogs.logchamp",
 ]
 
+# rarely used cogs, loaded after the bot is ready so it comes online sooner
+DEFERRED_COGS = {
+    "jishaku",
+    "cogs.devtools",
+}
+
+# logging (see utils/utility.py)
+LOG_MAX_BYTES = 20 * 1024 * 1024  # rotate the log file at this size...
+LOG_MAX_AGE = 24 * 60 * 60  # ...or after this many seconds
+LOG_BACKUPS = 10
+LOG_COMPRESS = True  # gzip rotated log files
+
+# instrumentation (see utils/metrics.py)
+METRICS_FILE = "logs/metrics.prom"  # Prometheus text dump, None to disable
+METRICS_DUMP_INTERVAL = 15  # seconds
+METRICS_PORT = None  # serve /metrics on localhost:PORT if set
+LOOP_LAG_INTERVAL = 0.5  # seconds
+
+# resource monitor (see cogs/monitor.py)
+MONITOR_INTERVAL = 30  # seconds between samples
+MONITOR_HISTORY = 2 * 60 * 2  # samples kept, 2 hours
+MONITOR_ALERT_CHANNEL = None  # channel id for threshold alerts, None to only log
+MONITOR_ALERT_COOLDOWN = 30 * 60  # seconds between alerts about the same thing
+MONITOR_THRESHOLDS = {
+    "rss_mb": 1024,
+    "cpu_percent": 90,
+    "open_fds": 1000,
+    "loop_lag_ms": 250,
+    "latency_ms": 2000,
+}
+
+# --profile-startup fails if imports + cog loading take longer than this (seconds)
+STARTUP_BUDGET = 10.0
+
 ADMINS = {
     204414611578028034,  # rev
     304695409031512064,  # dove
@@ -37,26 +72,47 @@ MODS = {
 """
 }
 
-intents = disnake.Intents(
-    # most stuff still enabled
+# gateway intents and caches, pick a profile with --cache-profile
+# every profile keeps guild messages and message content for commands
+_base_intents = dict(
     guilds=True,
+    guild_messages=True,
+    message_content=True,
+)
+
+# commands only: no member list, no message cache
+_minimal_intents = disnake.Intents(**_base_intents)
+
+# what the loaded cogs use: members (member stats, mod cache, join logs), bans,
+# invites (raid invite tracking). typing, voice, emojis, integrations, webhooks,
+# reactions, presences and DMs aren't used by anything
+_moderation_intents = disnake.Intents(
+    **_base_intents,
     members=True,
     bans=True,
-    emojis=True,
-    integrations=True,
-    webhooks=True,
     invites=True,
-    voice_states=True,
-    # presences is bad
-    presences=False,
-    # enable guild stuff
-    guild_messages=True,
-    guild_reactions=True,
-    guild_typing=True,
-    # disable DM stuff
-    dm_messages=False,
-    dm_reactions=False,
-    dm_typing=False,
-    # fuck message content
-    message_content=True,
 )
+
+PROFILES = {
+    "minimal": dict(
+        intents=_minimal_intents,
+        member_cache_flags=disnake.MemberCacheFlags.none(),
+        max_messages=None,
+        chunk_guilds_at_startup=False,
+    ),
+    "moderation": dict(
+        intents=_moderation_intents,
+        member_cache_flags=disnake.MemberCacheFlags.from_intents(_moderation_intents),
+        max_messages=1000,
+        chunk_guilds_at_startup=True,
+    ),
+    # bigger message cache so edit/delete logs and raid cleanup still see the
+    # messages of a busy raid
+    "raid-defense": dict(
+        intents=_moderation_intents,
+        member_cache_flags=disnake.MemberCacheFlags.from_intents(_moderation_intents),
+        max_messages=10000,
+        chunk_guilds_at_startup=True,
+    ),
+}
+CACHE_PROFILE = "moderation"
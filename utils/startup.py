@@ -0,0 +1,112 @@
+import contextlib
+import importlib.abc
+import logging
+import sys
+import time
+
+logger = logging.getLogger("utils.startup")
+
+
+class StartupTimer:
+    """Records how long each step of startup (imports, cog loads, ...) took."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = []  # (category, name, seconds)
+
+    @contextlib.contextmanager
+    def measure(self, category, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((category, name, time.perf_counter() - start))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def total(self, category):
+        return sum(seconds for cat, _, seconds in self.timings if cat == category)
+
+    def report(self, top_modules=25):
+        lines = [f"Startup timing ({self.elapsed():.3f}s since launch):"]
+        modules = []
+        for category, name, seconds in self.timings:
+            if category == "module":
+                modules.append((seconds, name))
+            else:
+                lines.append(f"  {category:<8} {name:<40} {seconds * 1000:>9.1f}ms")
+        if modules:
+            modules.sort(reverse=True)
+            lines.append(
+                f"Slowest of {len(modules)} module imports "
+                f"(self time, {self.total('module'):.3f}s total):"
+            )
+            for seconds, name in modules[:top_modules]:
+                lines.append(f"  {name:<49} {seconds * 1000:>9.1f}ms")
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.report(top_modules=None) + "\n")
+
+
+class _TimedLoader:
+    """Wraps a module loader, timing exec_module."""
+
+    def __init__(self, loader, profiler, fullname):
+        self._loader = loader
+        self._profiler = profiler
+        self._fullname = fullname
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # restore the real loader so nothing else ever sees the wrapper
+        module.__loader__ = module.__spec__.loader = self._loader
+        self._profiler.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.exit(self._fullname)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Records how long every module import takes into a StartupTimer, as self
+    time (excluding nested imports), like python -X importtime."""
+
+    def __init__(self, timer):
+        self.timer = timer
+        self._stack = []  # time spent in nested imports, per active import
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self, fullname)
+                return spec
+        return None
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, fullname):
+        start, nested = self._stack.pop()
+        total = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][1] += total
+        self.timer.timings.append(("module", fullname, total - nested))
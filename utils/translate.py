@@ -1,22 +1,132 @@
-from google.cloud.translate_v3.services.translation_service import (
-    TranslationServiceAsyncClient,
-)
-from google.cloud.translate_v3.types.translation_service import (
-    GetSupportedLanguagesRequest,
-    TranslateTextRequest,
-)
-from google.oauth2.service_account import Credentials
+import asyncio
+import hashlib
+import json
+import logging
+import os
 
-from auth import CLOUD_CREDS_FILE, CLOUD_PROJ_ID
+from utils.cache import LRUCache, SingleFlight
+
+logger = logging.getLogger("utils.translate")
+
+CACHE_SIZE = 2048
+CACHE_TTL = 24 * 60 * 60  # seconds
+BATCH_WINDOW = 0.005  # seconds to wait for more requests with the same target language
+BATCH_MAX_SIZE = 128  # contents per TranslateTextRequest
+BATCH_MAX_CHARS = 30000  # total characters per request, the API's recommended max
+RETRY_DELAY = 1  # seconds before retrying a batch after a server or network error
+
+
+def cache_key(text, lang):
+    # collapse whitespace so trivially different copies of a message share an entry
+    normalized = " ".join(text.split())
+    digest = hashlib.sha256(normalized.encode()).hexdigest()
+    return digest, lang.lower()
 
 
 class Translate:
-    def __init__(self):
-        credentials = Credentials.from_service_account_file(CLOUD_CREDS_FILE)
-        self.client = TranslationServiceAsyncClient(credentials=credentials)
+    def __init__(self, client=None, cache_file=None, lang_file=None):
+        self._client = client
+        # lowercase display name or code -> code, and code -> display name
         self.lang_cache = {}
+        self.lang_names = {}
+        self.lang_file = lang_file
+        self._langs_fresh = False  # whether lang_cache came from the API this run
+        self._single_flight = SingleFlight()
+        if lang_file:
+            self.load_langs()
+        # (text hash, target lang) -> (translation, detected source lang)
+        self.cache = LRUCache(CACHE_SIZE, ttl=CACHE_TTL)
+        self.cache_file = cache_file
+        if cache_file:
+            self.load_cache()
+        # target lang -> pending [(text, future)] waiting to be sent as one request
+        self._batches = {}
+        self._batch_chars = {}  # target lang -> characters in the pending batch
+        self._batch_tasks = set()
+
+    @property
+    def client(self):
+        # google-cloud-translate is slow to import and the client reads credentials
+        # from disk, so both wait until the first request that actually needs them
+        if self._client is None:
+            from google.cloud.translate_v3.services.translation_service import (
+                TranslationServiceAsyncClient,
+            )
+            from google.oauth2.service_account import Credentials
+
+            from auth import CLOUD_CREDS_FILE
+
+            credentials = Credentials.from_service_account_file(CLOUD_CREDS_FILE)
+            self._client = TranslationServiceAsyncClient(credentials=credentials)
+            logger.info("Created translation client.")
+        return self._client
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file) as fp:
+                entries = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load translation cache: {e}")
+            return
+        self.cache.load(
+            (
+                (tuple(key), tuple(value), expires_at)
+                for key, value, expires_at in entries
+            )
+        )
+        logger.info(f"Loaded {len(self.cache)} cached translations.")
+
+    def save_cache(self):
+        if not self.cache_file:
+            return
+        tmp = self.cache_file + ".tmp"
+        try:
+            with open(tmp, "w") as fp:
+                json.dump(self.cache.dump(), fp)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            logger.warning(f"Could not save translation cache: {e}")
+
+    def _set_langs(self, names):
+        lang_cache = {}
+        for code, name in names.items():
+            lang_cache[name.lower()] = code
+            lang_cache[code.lower()] = code
+        self.lang_names = names
+        self.lang_cache = lang_cache
+
+    def load_langs(self):
+        """Loads the language table snapshot saved by the last API fetch."""
+        try:
+            with open(self.lang_file) as fp:
+                self._set_langs(json.load(fp))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load language snapshot: {e}")
+
+    def save_langs(self):
+        tmp = self.lang_file + ".tmp"
+        try:
+            with open(tmp, "w") as fp:
+                json.dump(self.lang_names, fp)
+            os.replace(tmp, self.lang_file)
+        except OSError as e:
+            logger.warning(f"Could not save language snapshot: {e}")
 
     async def get_all_langs(self):
+        # concurrent callers share a single get_supported_languages request
+        await self._single_flight.do("langs", self._fetch_langs)
+
+    async def _fetch_langs(self):
+        from google.cloud.translate_v3.types.translation_service import (
+            GetSupportedLanguagesRequest,
+        )
+
+        from auth import CLOUD_PROJ_ID
+
         result = await self.client.get_supported_languages(
             request=GetSupportedLanguagesRequest(
                 **{
@@ -25,26 +135,147 @@ class Translate:
                 }
             )
         )
-        for lang in result.languages:
-            self.lang_cache[lang.display_name.lower()] = lang.language_code
-            self.lang_cache[lang.language_code] = lang.language_code
+        self._set_langs(
+            {lang.language_code: lang.display_name for lang in result.languages}
+        )
+        self._langs_fresh = True
+        logger.info(f"Fetched {len(self.lang_names)} supported languages.")
+        if self.lang_file:
+            self.save_langs()
 
     async def convert_lang(self, arg):
         if not self.lang_cache:
             await self.get_all_langs()
+        elif not self._langs_fresh and "langs" not in self._single_flight:
+            # answer from the snapshot, refresh it in the background
+            task = asyncio.ensure_future(self.get_all_langs())
+            task.add_done_callback(self._log_refresh_error)
 
         return self.lang_cache.get(arg.lower())
 
+    @staticmethod
+    def _log_refresh_error(task):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Could not refresh language list: {task.exception()}")
+
     async def translate(self, text, lang="en"):
-        result = await self.client.translate_text(
+        if not text.strip():
+            # nothing to translate, and the API rejects empty contents
+            return text, None
+        key = cache_key(text, lang)
+        cached = self.cache.get(key)
+        if cached:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.get(lang)
+        if batch is not None and self._batch_chars[lang] + len(text) > BATCH_MAX_CHARS:
+            self._flush_batch(lang, batch)
+            batch = None
+        if batch is None:
+            batch = self._batches[lang] = []
+            self._batch_chars[lang] = 0
+            loop.call_later(BATCH_WINDOW, self._flush_batch, lang, batch)
+        batch.append((text, future))
+        self._batch_chars[lang] += len(text)
+        if len(batch) >= BATCH_MAX_SIZE:
+            self._flush_batch(lang, batch)
+        return await future
+
+    async def translate_many(self, texts, lang="en", return_exceptions=False):
+        """Translates several texts at once. Returns (translation, detected lang) pairs
+        in the same order, or with return_exceptions, the exception for texts that
+        couldn't be translated. Requests issued together end up in one API call."""
+        return await asyncio.gather(
+            *(self.translate(text, lang) for text in texts),
+            return_exceptions=return_exceptions,
+        )
+
+    def _flush_batch(self, lang, batch):
+        # called both by the batch timer and when a batch fills up, only send once
+        if self._batches.get(lang) is not batch:
+            return
+        del self._batches[lang]
+        del self._batch_chars[lang]
+        task = asyncio.create_task(self._send_batch(lang, batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, lang, batch):
+        # duplicate texts in one batch only need to be translated once
+        contents = list(dict.fromkeys(text for text, _ in batch))
+        logger.debug(f"sending translation batch of {len(contents)} to {lang}")
+        # every caller waits on its future, so each one must end up done
+        try:
+            results = await self._translate_contents(lang, contents)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.exception("Translation batch failed")
+            results = dict.fromkeys(contents, e)
+        for text, future in batch:
+            if future.done():
+                continue
+            result = results.get(text)
+            if result is None:
+                future.set_exception(
+                    RuntimeError("The translation API returned no result.")
+                )
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _translate_contents(self, lang, contents, retry=True):
+        """Returns text -> (translation, detected lang), or the exception for texts
+        that failed. A request the API rejects is split in half and retried, so a
+        bad text only fails itself. Server and network errors are retried once."""
+        from google.api_core.exceptions import ClientError
+
+        try:
+            result = await self._request(lang, contents)
+        except ClientError as e:
+            if len(contents) == 1:
+                return {contents[0]: e}
+            middle = len(contents) // 2
+            first, second = await asyncio.gather(
+                self._translate_contents(lang, contents[:middle], retry),
+                self._translate_contents(lang, contents[middle:], retry),
+            )
+            return {**first, **second}
+        except Exception as e:
+            if not retry:
+                return {text: e for text in contents}
+            logger.warning(f"Translation request failed, retrying: {e}")
+            await asyncio.sleep(RETRY_DELAY)
+            return await self._translate_contents(lang, contents, retry=False)
+
+        results = {}
+        for text, translation in zip(contents, result.translations):
+            results[text] = (
+                translation.translated_text,
+                translation.detected_language_code,
+            )
+            self.cache.set(cache_key(text, lang), results[text])
+        return results
+
+    async def _request(self, lang, contents):
+        from google.cloud.translate_v3.types.translation_service import (
+            TranslateTextRequest,
+        )
+
+        from auth import CLOUD_PROJ_ID
+
+        return await self.client.translate_text(
             TranslateTextRequest(
                 **{
                     "parent": f"projects/{CLOUD_PROJ_ID}/locations/global",
-                    "contents": [text],
+                    "contents": contents,
                     "mime_type": "text/plain",  # mime types: text/plain, text/html
                     "target_language_code": lang,
                 }
             )
         )
-        translation = result.translations[0]
-        return translation.translated_text, translation.detected_language_code
@@ -1,9 +1,19 @@
+import atexit
+import gzip
 import logging
+import os
+import queue
+import shutil
 import sys
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import disnake
 from disnake.ext import commands
 
+from utils import settings
+
 logger = logging.getLogger("utils.utility")
 
 
@@ -30,21 +40,55 @@ def list_by_category(guild):
     return channels
 
 
-def setup_logger(name, debug, dt):
-    logger = logging.getLogger(name)
-    time = f"{dt.month}-{dt.day}_{dt.hour}h{dt.minute}m"
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
 
-    filename = "logs/{}.log"
-    if debug:
-        level = logging.DEBUG
-    else:
-        level = logging.INFO
 
-    file_handler = logging.FileHandler(filename.format(time))
-    # file_handler.setLevel(level)
+class RotatingLogHandler(RotatingFileHandler):
+    """Rolls the log over once it reaches max_bytes or max_age seconds,
+    gzipping rotated files if compress is set."""
+
+    def __init__(self, filename, max_bytes, max_age, backup_count, compress=False):
+        super().__init__(
+            filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+        )
+        self.max_age = max_age
+        self.opened_at = time.time()
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = _gzip_rotator
+
+    def shouldRollover(self, record):
+        if self.max_age and time.time() - self.opened_at >= self.max_age:
+            return True
+        return super().shouldRollover(record)
 
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+
+_log_queue = None
+_log_listener = None
+
+
+def _start_log_listener(dt):
+    # all loggers share one queue, the actual file/stdout writes happen on the
+    # listener's thread so logging never blocks the event loop
+    global _log_queue, _log_listener
+    time_ = f"{dt.month}-{dt.day}_{dt.hour}h{dt.minute}m"
+    filename = "logs/{}.log"
+
+    file_handler = RotatingLogHandler(
+        filename.format(time_),
+        max_bytes=settings.LOG_MAX_BYTES,
+        max_age=settings.LOG_MAX_AGE,
+        backup_count=settings.LOG_BACKUPS,
+        compress=settings.LOG_COMPRESS,
+    )
     stream_handler = logging.StreamHandler(sys.stdout)
-    # stream_handler.setLevel(level)
 
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -52,17 +96,114 @@ def setup_logger(name, debug, dt):
     file_handler.setFormatter(formatter)
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    _log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_queue, file_handler, stream_handler)
+    _log_listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flushes queued log records and stops the writer thread."""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+
+def setup_logger(name, debug, dt):
+    logger = logging.getLogger(name)
+    if _log_listener is None:
+        _start_log_listener(dt)
+
+    if debug:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+
+    logger.addHandler(QueueHandler(_log_queue))
     logger.setLevel(level)
     return logger
 
 
-async def fetch_previous_message(message, cache=None):
+class MessageIndex:
+    """Remembers the ids of the most recent messages in each channel, in order, so
+    the message sent before a given one can be looked up without scanning or
+    fetching history. Only ids are kept, the messages themselves stay in the
+    client's message cache. Fed from gateway events by the bot."""
+
+    def __init__(self, per_channel=50):
+        self.per_channel = per_channel
+        self._channels = {}  # channel id -> OrderedDict[message id, None]
+        self._prev = {}  # message id -> id of the message before it in its channel
+        self._next = {}  # message id -> id of the message after it in its channel
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._channels.values())
+
+    def add(self, message):
+        messages = self._channels.setdefault(message.channel.id, OrderedDict())
+        if messages:
+            last = next(reversed(messages))
+            self._prev[message.id] = last
+            self._next[last] = message.id
+        messages[message.id] = None
+        if len(messages) > self.per_channel:
+            oldest, _ = messages.popitem(last=False)
+            self._unlink(oldest)
+
+    def remove(self, channel_id, message_id):
+        messages = self._channels.get(channel_id)
+        if messages and message_id in messages:
+            del messages[message_id]
+            self._unlink(message_id)
+
+    def remove_channel(self, channel_id):
+        for message_id in self._channels.pop(channel_id, ()):
+            self._prev.pop(message_id, None)
+            self._next.pop(message_id, None)
+
+    def _unlink(self, message_id):
+        prev = self._prev.pop(message_id, None)
+        next_ = self._next.pop(message_id, None)
+        if prev is not None:
+            if next_ is not None:
+                self._next[prev] = next_
+            else:
+                self._next.pop(prev, None)
+        if next_ is not None:
+            if prev is not None:
+                self._prev[next_] = prev
+            else:
+                self._prev.pop(next_, None)
+
+    def previous(self, message):
+        """Returns the id of the message sent before message, or None."""
+        messages = self._channels.get(message.channel.id)
+        prev = self._prev.get(message.id)
+        if not messages or prev not in messages:
+            return None
+        return prev
+
+
+async def fetch_previous_message(message, cache=None, index=None):
+    # try the bot's message index if provided, it only knows the id so look the
+    # message up in the cache, or fetch just that one
+    prev = index.previous(message) if index is not None else None
+    if prev is not None:
+        # recent messages are at the end of the cache
+        for m in reversed(cache or ()):
+            if m.id == prev:
+                return m
+        try:
+            return await message.channel.fetch_message(prev)
+        except disnake.HTTPException:
+            pass
     # try cache if provided
     if cache:
         use_next = False
-        for m in cache[::-1]:
+        for m in reversed(cache):
             if use_next and m.channel.id == message.channel.id:
                 return m
             if m.id == message.id: